@@ -0,0 +1,183 @@
+"""
+The optional compression stage of `QRCodec`.
+
+The file is compressed before it is chunked, the compressed stream starts
+with a 4 bytes header: the magic b'\\x89QZ' and the method. The decoders
+look for the header in the file they recovered and decompress it in place,
+so nothing has to be told to them. A file sent as it is that starts with the
+magic itself goes behind a header of its own too, see `store_file`, so every
+file starting with the magic was given its header by the encoder.
+
+Both directions work block by block through the compressobj/decompressobj
+interfaces, the compressed stream is spooled to a temporary file.
+"""
+import bz2
+import lzma
+import os
+import shutil
+import tempfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, 'zstd' is only available when it is installed
+    zstandard = None
+
+DECOMPRESS_ERRORS = (ValueError, OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+__all__ = ['MAGIC', 'available_methods', 'compress_file', 'store_file', 'decompress_file']
+
+
+MAGIC = b'\x89QZ'
+STORED = 0  # the method of a file sent as it is behind the header, see store_file
+METHODS = {'zlib': 1, 'bz2': 2, 'lzma': 3, 'zstd': 4}
+BLOCK_SIZE = 1 << 20
+SAMPLE_SIZE = 1 << 20  # bytes 'auto' tries every method on
+SPOOL_SIZE = 32 << 20  # compressed streams smaller than this stay in memory
+
+
+def available_methods():
+    """
+    The compression methods that can be used here.
+    """
+    return [name for name in METHODS if name != 'zstd' or zstandard is not None]
+
+
+def _compressor(name):
+    if name == 'zlib':
+        return zlib.compressobj(9)
+    if name == 'bz2':
+        return bz2.BZ2Compressor(9)
+    if name == 'lzma':
+        return lzma.LZMACompressor(preset=6)
+    if name == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is required for the zstd compression.')
+        return zstandard.ZstdCompressor(level=19).compressobj()
+    raise ValueError('unknown compression method: ' + str(name))
+
+
+def _decompressor(name):
+    if name == 'zlib':
+        return zlib.decompressobj()
+    if name == 'bz2':
+        return bz2.BZ2Decompressor()
+    if name == 'lzma':
+        return lzma.LZMADecompressor()
+    if name == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstandard is required for the zstd compression.')
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError('unknown compression method: ' + str(name))
+
+
+def _compressed_size(data, name):
+    compressor = _compressor(name)
+    return len(compressor.compress(data)) + len(compressor.flush())
+
+
+def choose_method(sample):
+    """
+    The method that compresses `sample` best, None if none of them shrinks it.
+    """
+    best, best_size = None, len(sample)
+    for name in available_methods():
+        size = _compressed_size(sample, name)
+        if size < best_size:
+            best, best_size = name, size
+    return best
+
+
+def compress_file(f, method='auto'):
+    """
+    Compress an opened binary file from its current position.
+    'auto' picks the method by compressing the first `SAMPLE_SIZE` bytes with each one.
+    When the compressed stream, header included, is not smaller than the file,
+    the file is rewound and None is returned: the file should be sent as it is.
+
+    :param f: file object opened in 'rb' mode
+    :param method: one of `available_methods()`, or 'auto'
+    :return: a temporary file holding the header and the compressed stream, positioned at 0, or None
+    """
+    start = f.tell()
+    if method == 'auto':
+        method = choose_method(f.read(SAMPLE_SIZE))
+        f.seek(start)
+        if method is None:
+            return None
+
+    compressor = _compressor(method)
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    out.write(MAGIC + bytes([METHODS[method]]))
+    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+        out.write(compressor.compress(block))
+    out.write(compressor.flush())
+
+    if out.tell() >= f.tell() - start:
+        out.close()
+        f.seek(start)
+        return None
+    out.seek(0)
+    return out
+
+
+def store_file(f):
+    """
+    Put the header of method `STORED` in front of an opened binary file sent as it is, if it starts with
+    the magic: the decoders would take it for a compressed stream otherwise. They strip the header.
+
+    :param f: file object opened in 'rb' mode
+    :return: a temporary file holding the header and the file, positioned at 0,
+        or None if the file does not start with the magic and can be sent as it is
+    """
+    start = f.tell()
+    magic = f.read(len(MAGIC))
+    f.seek(start)
+    if magic != MAGIC:
+        return None
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    out.write(MAGIC + bytes([STORED]))
+    shutil.copyfileobj(f, out, BLOCK_SIZE)
+    out.seek(0)
+    return out
+
+
+def decompress_file(path):
+    """
+    Decompress in place a file recovered by the decoder, if it starts with the header.
+    The encoder gives the header to every file that starts with the magic, so a stream that does not
+    decompress, is cut short or is followed by other data raises `ValueError`, the file is left as it is.
+
+    :param path: the file to decompress
+    :return: the method used, None if the file was not compressed
+    """
+    names = {value: name for name, value in METHODS.items()}
+    names[STORED] = None
+    with open(path, 'rb') as f:
+        header = f.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            return None
+        if len(header) < len(MAGIC) + 1 or header[-1] not in names:
+            raise ValueError('Unknown compression header.')
+        method = names[header[-1]]
+        decompressor = _decompressor(method) if method is not None else None
+
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(temp_fd, 'wb') as out:
+                if decompressor is None:
+                    shutil.copyfileobj(f, out, BLOCK_SIZE)
+                else:
+                    for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+                        out.write(decompressor.decompress(block))
+                    if hasattr(decompressor, 'flush'):
+                        out.write(decompressor.flush())
+                    # a stream cut short reads without error, up to where it stops
+                    if not getattr(decompressor, 'eof', True) or getattr(decompressor, 'unused_data', b''):
+                        raise ValueError('truncated or followed by other data')
+        except DECOMPRESS_ERRORS as e:
+            os.remove(temp_path)
+            raise ValueError('Corrupt {} stream: {}'.format(method or 'stored', e)) from e
+    shutil.move(temp_path, path)
+    return method
@@ -0,0 +1,158 @@
+"""
+Reed-Solomon erasure coding across frames.
+
+A group of k data chunks of the same length gets m parity chunks,
+any k chunks out of the k + m rebuild the group. The code is a Cauchy
+matrix over GF(256): parity j is the sum of the data chunks i weighted
+by 1 / (x_i + y_j), with x_i = i and y_j = 255 - j, so k + m may not
+exceed 256. Every square sub-matrix of a Cauchy matrix is invertible,
+which is what makes any k chunks enough.
+
+Multiplying a chunk by a constant is a `bytes.translate` through the
+multiplication table of that constant, adding chunks is a XOR of
+integers, so no byte is touched in Python.
+"""
+
+
+__all__ = ['MAX_CHUNKS', 'accumulate', 'parity', 'recover']
+
+
+MAX_CHUNKS = 256
+
+# GF(256) with the polynomial x^8 + x^4 + x^3 + x^2 + 1, the one QR codes use
+EXP = [0] * 512
+LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    EXP[_i] = _x
+    LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    EXP[_i] = EXP[_i - 255]
+
+_mul_tables = {}
+
+
+def mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return EXP[LOG[a] + LOG[b]]
+
+
+def inv(a):
+    if a == 0:
+        raise ZeroDivisionError('0 has no inverse in GF(256)')
+    return EXP[255 - LOG[a]]
+
+
+def _mul_table(c):
+    """
+    The table that multiplies every byte by `c`, for `bytes.translate`.
+    """
+    if c not in _mul_tables:
+        _mul_tables[c] = bytes(mul(c, x) for x in range(256))
+    return _mul_tables[c]
+
+
+def coefficient(j, i):
+    """
+    The weight of data chunk `i` in parity chunk `j`.
+    """
+    return inv(i ^ (255 - j))
+
+
+def _check(k, m):
+    if k + m > MAX_CHUNKS:
+        raise ValueError('At most {} data and parity chunks per group, got {}.'.format(MAX_CHUNKS, k + m))
+
+
+def _combine(weighted, size):
+    """
+    Sum of the chunks weighted by their coefficients, `weighted` holds (coefficient, chunk) pairs.
+    """
+    acc = 0
+    for c, chunk in weighted:
+        if c:
+            acc ^= int.from_bytes(chunk.translate(_mul_table(c)), 'little')
+    return acc.to_bytes(size, 'little')
+
+
+def accumulate(acc, i, chunk):
+    """
+    Add a data chunk to the parity chunks of its group, for the parity to be computed
+    as the chunks go by instead of keeping them all. A chunk shorter than the others
+    counts as padded with zeros.
+
+    :param acc: list of the m parity chunks so far as little-endian integers, updated in place
+    :param i: position of the chunk in the group
+    :param chunk: the data chunk, bytes
+    """
+    for j in range(len(acc)):
+        acc[j] ^= int.from_bytes(chunk.translate(_mul_table(coefficient(j, i))), 'little')
+
+
+def parity(chunks, m):
+    """
+    Compute the parity chunks of a group.
+
+    :param chunks: list of the k data chunks, bytes of the same length
+    :param m: number of parity chunks
+    :return: list of the m parity chunks
+    """
+    _check(len(chunks), m)
+    size = len(chunks[0]) if chunks else 0
+    acc = [0] * m
+    for i, chunk in enumerate(chunks):
+        accumulate(acc, i, chunk)
+    return [p.to_bytes(size, 'little') for p in acc]
+
+
+def _invert(matrix):
+    """
+    Invert a square matrix over GF(256) by Gauss-Jordan elimination.
+    """
+    n = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next((r for r in range(col, n) if rows[r][col]), None)
+        if pivot is None:
+            raise ValueError('Singular matrix.')
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = inv(rows[col][col])
+        rows[col] = [mul(scale, v) for v in rows[col]]
+        for r in range(n):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [v ^ mul(factor, p) for v, p in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+def recover(k, data, parities):
+    """
+    Rebuild the missing data chunks of a group.
+    `ValueError` is raised if fewer than k chunks of the group are given.
+
+    :param k: number of data chunks in the group
+    :param data: dict of the data chunks received, position -> bytes
+    :param parities: dict of the parity chunks received, parity index -> bytes
+    :return: dict of the rebuilt data chunks, position -> bytes
+    """
+    missing = [i for i in range(k) if i not in data]
+    if not missing:
+        return {}
+    if len(missing) > len(parities):
+        raise ValueError('{} chunks missing, only {} parity chunks.'.format(len(missing), len(parities)))
+    _check(k, max(parities) + 1)
+
+    rows = sorted(parities)[:len(missing)]
+    size = len(parities[rows[0]])
+    # take the data received out of the parity chunks, what remains only depends on the missing chunks
+    syndromes = []
+    for j in rows:
+        weighted = [(1, parities[j])] + [(coefficient(j, i), chunk) for i, chunk in data.items()]
+        syndromes.append(_combine(weighted, size))
+
+    inverse = _invert([[coefficient(j, i) for i in missing] for j in rows])
+    return {i: _combine(zip(row, syndromes), size) for i, row in zip(missing, inverse)}
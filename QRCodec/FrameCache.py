@@ -0,0 +1,302 @@
+"""
+A content-addressed cache of rendered frames.
+
+Sparse files, zero-padded images and repetitive logs make many identical
+chunks, and an identical chunk rendered with the same settings gives the same
+frame. The cache keys the finished frame bytes, graphics control block
+excluded, by a hash of the chunk and of the `FrameSpec` it is rendered with
+(version, error correction, mask, size, palette), and keeps the most recently
+used ones up to a byte budget. With a `path` the frames are also written to
+that directory, one file per key, and found there by later runs.
+
+The frames of a GIF are found by the same keys in `GIFFrames`: a new revision
+of a file copies the frames of the chunks that did not change byte for byte out
+of the previous GIF. A sidecar manifest, see `write_manifest`, lists the keys and
+the offsets of the frames of a GIF so that it does not have to be decoded.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import tempfile
+
+
+__all__ = ['FrameCache', 'CachedBatch', 'GIFFrames', 'frame_key', 'manifest_path', 'write_manifest']
+
+
+MANIFEST_FORMAT = 1
+
+
+def frame_key(spec, chunk):
+    """
+    The cache key of a chunk rendered with `spec`.
+
+    :param spec: the FrameSpec of the frames, or anything with a stable repr
+    :param chunk: the chunk, a string, bytes or a qrcode.util.QRData
+    :return: the key, bytes
+    """
+    h = hashlib.blake2b(repr(tuple(spec)).encode(), digest_size=16)
+    if isinstance(chunk, str):
+        h.update(b's' + chunk.encode())
+    elif isinstance(chunk, (bytes, bytearray, memoryview)):
+        h.update(b'b' + bytes(chunk))
+    else:  # QRData
+        h.update(b'd' + str(chunk.mode).encode() + b':' + bytes(chunk.data))
+    return h.digest()
+
+
+class FrameCache(object):
+    """
+    A LRU cache of frames, bounded by the bytes it holds, optionally backed by a directory.
+    `hits`, `disk_hits` (counted in `hits` too) and `misses` count the lookups.
+    """
+    def __init__(self, max_bytes=64 << 20, path=None):
+        """
+        :param max_bytes: the most frame bytes held in memory
+        :param path: directory to persist the frames in, None to keep them in memory only
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames or self.path is not None and os.path.exists(self._file(key))
+
+    def _file(self, key):
+        name = key.hex()
+        return os.path.join(self.path, name[:2], name)
+
+    def get(self, key):
+        """
+        The frame of `key`, None if it is not cached.
+        """
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+        if self.path is not None:
+            try:
+                with open(self._file(key), 'rb') as f:
+                    frame = f.read()
+            except OSError:
+                pass
+            else:
+                self._remember(key, frame)
+                self.hits += 1
+                self.disk_hits += 1
+                return frame
+        self.misses += 1
+        return None
+
+    def put(self, key, frame):
+        """
+        Cache the frame of `key`.
+        """
+        frame = bytes(frame)
+        if self.path is not None and key not in self._frames:
+            file_path = self._file(key)
+            if not os.path.exists(file_path):
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                # written aside and renamed, a concurrent run never reads half a frame
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path))
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(frame)
+                os.replace(temp_path, file_path)
+        self._remember(key, frame)
+
+    def _remember(self, key, frame):
+        if key in self._frames:
+            self.size -= len(self._frames.pop(key))
+        if len(frame) > self.max_bytes:
+            return
+        self._frames[key] = frame
+        self.size += len(frame)
+        while self.size > self.max_bytes:
+            _, old = self._frames.popitem(last=False)
+            self.size -= len(old)
+
+    def clear(self):
+        """
+        Forget the frames held in memory, the directory is left as it is.
+        """
+        self._frames.clear()
+        self.size = 0
+
+
+def manifest_path(gif_path):
+    """
+    The path of the sidecar manifest of a GIF.
+    """
+    return gif_path + '.frames.json'
+
+
+def write_manifest(gif_path, frames):
+    """
+    Write the sidecar manifest of a GIF, once the GIF is closed.
+    The size and the modification time of the GIF are recorded, the manifest of a GIF written again since is ignored.
+
+    :param gif_path: the GIF file
+    :param frames: list of (key, offset, length) of the frames of the GIF, see `GIFdecoder.Frame`
+    :return: the path of the manifest
+    """
+    stat = os.stat(gif_path)
+    manifest = {'format': MANIFEST_FORMAT, 'gif_size': stat.st_size, 'gif_mtime_ns': stat.st_mtime_ns,
+                'frames': [[key.hex(), offset, length] for key, offset, length in frames]}
+    path = manifest_path(gif_path)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(temp_path, path)
+    return path
+
+
+class GIFFrames(object):
+    """
+    The frames of a GIF written before, read back byte for byte from the file by key.
+    It has the `get` and `put` of `FrameCache`, a `CachedBatch` on it renders only the frames the GIF misses.
+    `hits` and `misses` count the lookups, the hits of `fallback` included.
+    """
+    def __init__(self, gif_path, index, fallback=None):
+        """
+        :param gif_path: the GIF file
+        :param index: dict of key -> (offset, length) of the frames in the GIF
+        :param fallback: a FrameCache to look the other frames up in and to keep the rendered ones, None for none
+        """
+        self.gif_path = gif_path
+        self.index = index
+        self.fallback = fallback
+        self.hits = 0
+        self.misses = 0
+        self._file = open(gif_path, 'rb')
+
+    @classmethod
+    def from_manifest(cls, gif_path, fallback=None):
+        """
+        The frames of a GIF, indexed by its sidecar manifest.
+
+        :param gif_path: the GIF file
+        :param fallback: see `GIFFrames`
+        :return: GIFFrames, None if the GIF has no manifest or has been written again since
+        """
+        try:
+            with open(manifest_path(gif_path)) as f:
+                manifest = json.load(f)
+            stat = os.stat(gif_path)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('format') != MANIFEST_FORMAT or \
+                (manifest.get('gif_size'), manifest.get('gif_mtime_ns')) != (stat.st_size, stat.st_mtime_ns):
+            return None
+        index = {}
+        for key, offset, length in manifest['frames']:
+            index.setdefault(bytes.fromhex(key), (offset, length))
+        return cls(gif_path, index, fallback)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index or self.fallback is not None and key in self.fallback
+
+    def get(self, key):
+        """
+        The frame of `key`, None if neither the GIF nor the fallback has it.
+        """
+        if key in self.index:
+            offset, length = self.index[key]
+            self._file.seek(offset)
+            frame = self._file.read(length)
+            if len(frame) == length:
+                self.hits += 1
+                return frame
+        frame = self.fallback.get(key) if self.fallback is not None else None
+        if frame is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return frame
+
+    def put(self, key, frame):
+        """
+        Keep a rendered frame in the fallback, the GIF is read only.
+        """
+        if self.fallback is not None:
+            self.fallback.put(key, frame)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CachedBatch(object):
+    """
+    A batch of frames, taken from the cache where possible and rendered by a worker pool otherwise.
+    A chunk appearing twice is rendered once, across the batches sharing `pending` too.
+    It has the `get` of `multiprocessing.pool.AsyncResult`, returning the list of frames.
+    """
+    def __init__(self, cache, runner, func, spec, chunks, pending=None):
+        """
+        :param cache: the FrameCache, or the GIFFrames of a previous GIF
+        :param runner: where to render the frames, anything with `apply_async`
+        :param func: the function rendering the frames, `func(spec, chunks)` returns the list of frames
+        :param spec: the FrameSpec of the frames
+        :param chunks: list of the chunks to convert to QR code
+        :param pending: dict shared by the batches in flight, key -> (batch, position) of the frames sent
+        """
+        self.cache = cache
+        self.pending = pending
+        self._frames = [None] * len(chunks)
+        self._refs = []  # (position, (batch, position in the frames it renders))
+        self._sent = {}  # key -> position in the frames this batch renders
+        self._rendered = None
+        misses = []
+        for i, chunk in enumerate(chunks):
+            key = frame_key(spec, chunk)
+            if key in self._sent:
+                ref = (self, self._sent[key])
+                cache.hits += 1
+            elif pending is not None and key in pending:
+                ref = pending[key]
+                cache.hits += 1
+            else:
+                frame = cache.get(key)
+                if frame is not None:
+                    self._frames[i] = frame
+                    continue
+                self._sent[key] = len(misses)
+                misses.append(chunk)
+                ref = (self, self._sent[key])
+                if pending is not None:
+                    pending[key] = ref
+            self._refs.append((i, ref))
+        self._result = runner.apply_async(func, args=(spec, misses)) if misses else None
+
+    def _render(self):
+        if self._rendered is None:
+            self._rendered = self._result.get() if self._result is not None else []
+            for key, j in self._sent.items():
+                self.cache.put(key, self._rendered[j])
+                if self.pending is not None and self.pending.get(key, (None,))[0] is self:
+                    del self.pending[key]
+        return self._rendered
+
+    def get(self, timeout=None):
+        for i, (batch, j) in self._refs:
+            self._frames[i] = batch._render()[j]
+        self._refs = []
+        return self._frames
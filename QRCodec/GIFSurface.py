@@ -3,6 +3,11 @@ from PIL import Image
 from functools import partial
 import GIFencoder as encoder
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, Render falls back to the pure python loop
+    np = None
+
 
 class GIFSurface(object):
     """
@@ -49,6 +54,13 @@ class GIFSurface(object):
     def write(self, data):
         self._io.write(data)
 
+    def tell(self):
+        """
+        The offset in the .gif file where the next write lands.
+        The global color table must be set.
+        """
+        return len(self._gif_header) + self._io.tell()
+
     def set_palette(self, palette):
         """
         Set the global color table of the GIF image.
@@ -93,22 +105,69 @@ class GIFSurface(object):
         """
         with open(filename, 'wb') as f:
             f.write(self._gif_header)
-            f.write(self._io.getvalue())
+            f.write(self._io.getbuffer())  # a view of the frames, no copy
             f.write(bytearray([0x3B]))
 
     def close(self):
         self._io.close()
 
 
+class GIFFileSurface(GIFSurface):
+    """
+    A GIFSurface that streams the frames straight into the .gif file
+    instead of buffering them in memory, so the memory used does not grow
+    with the number of frames.
+    Since the header goes first, the global color table must be given when
+    the surface is created. Call `save()` to finish the file.
+    """
+    def __init__(self, filename, width, height, palette, loop=0, bg_color=None):
+        """
+        ----------
+        Parameters
+        filename: path of the .gif file to write.
+        width, height: size of the image in pixels.
+        palette: the global color table, see `set_palette`.
+        loop: number of loops of the image.
+        bg_color: background color index.
+        """
+        self.width = width
+        self.height = height
+        self.loop = loop
+        self.palette = None
+        self.set_palette(palette)
+        self.filename = filename
+        self._io = open(filename, 'wb')
+        self._io.write(self._gif_header)
+
+        if bg_color is not None:
+            self.write(encoder.rectangle(0, 0, width, height, bg_color))
+
+    def save(self, filename=None):
+        """
+        Write the trailing '0x3B' and close the file.
+        The frames are already on disk, `filename` is only accepted for
+        compatibility with `GIFSurface.save` and must be the file opened.
+        """
+        if filename is not None and filename != self._io.name:
+            raise ValueError('A GIFFileSurface can only be saved to ' + self._io.name)
+        if not self._io.closed:
+            self._io.write(bytearray([0x3B]))
+        self.close()
+
+    def tell(self):
+        return self._io.tell()
+
+
 class Render(object):
     """
     This class encodes the region specified by the `frame_box` attribute of a maze
     into one frame in the GIF image.
     """
-    def __init__(self, cmap, mcl):
+    def __init__(self, cmap, mcl, vectorize=None):
         """
         cmap: a dict that maps the value of the cells to their color indices.
         mcl: the minimum code length for the LZW compression.
+        vectorize: map the cells with NumPy, defaults to True when NumPy is installed.
         A default dict is initialized so that one can set the colormap by
         just specifying what needs to be specified.
         """
@@ -117,6 +176,14 @@ class Render(object):
             self.colormap.update(cmap)
         self.compress = partial(encoder.lzw_compress, mcl=mcl)
 
+        if vectorize is None:
+            vectorize = np is not None
+        if vectorize and np is None:
+            raise ValueError('NumPy is required for the vectorized renderer.')
+        self.vectorize = vectorize
+        # the colormap as a lookup table indexed by the cell value
+        self._lut = np.array([self.colormap[i] for i in range(1 << mcl)], dtype=np.uint8) if vectorize else None
+
     def __call__(self, width, height, mat):
         """
         Encode current maze into one frame and return the encoded data.
@@ -126,9 +193,15 @@ class Render(object):
         left, top = 0, 0
         descriptor = encoder.image_descriptor(left, top, width, height)
 
-        pixels = [self.colormap[mat[x][y]]
-                  for x in range(width)
-                  for y in range(height)]
+        if self.vectorize:
+            # same order as the loop below, `mat[x][y]` with x running slowest,
+            # handed to the compressor as a bytes buffer
+            cells = np.asarray(mat, dtype=np.uint8)[:width, :height]
+            pixels = self._lut[cells].tobytes()
+        else:
+            pixels = [self.colormap[mat[x][y]]
+                      for x in range(width)
+                      for y in range(height)]
 
         # the compressed image data of this frame
         data = self.compress(pixels)
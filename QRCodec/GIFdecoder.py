@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+~~~~~~~~~~~~~~~~~~~~
+A simple GIF decoder
+~~~~~~~~~~~~~~~~~~~~
+
+Reads back the GIF files written by `GIFSurface`, see `GIFencoder` for the
+structure of a GIF file. Only what the encoder writes is supported:
+a global color table, optional local color tables, non-interlaced frames.
+The frames are not composited, each one is returned as it is stored.
+
+Reference for the GIF89a specification:
+
+    http://giflib.sourceforge.net/whatsinagif/index.html
+"""
+from collections import namedtuple
+from struct import unpack_from
+
+
+__all__ = ['Frame', 'read_gif', 'lzw_decompress']
+
+
+# `pixels` holds the color indices, row by row. `offset` and `length` locate the image block in the file,
+# from the image descriptor to the block terminator, the graphics control block excluded.
+Frame = namedtuple('Frame', ['left', 'top', 'width', 'height', 'palette', 'pixels', 'offset', 'length'])
+
+
+def read_gif(data):
+    """
+    Parse a GIF file held in `data` (bytes).
+    Return `(width, height, palette, frames)` where `palette` is the global color table
+    as a bytes object of rgb triples (None if there is none) and `frames` is a generator
+    of `Frame`. A `ValueError` is raised on anything this decoder cannot read.
+    """
+    data = memoryview(data)
+    if bytes(data[:3]) != b'GIF':
+        raise ValueError('Not a GIF file.')
+    width, height, byte = unpack_from('<2HB', data, 6)
+    offset = 13
+    palette = None
+    if byte & 0b10000000:
+        size = 3 << ((byte & 0b111) + 1)
+        palette = bytes(data[offset:offset + size])
+        offset += size
+    return width, height, palette, _iter_frames(data, offset, palette)
+
+
+def _iter_frames(data, offset, global_palette):
+    while True:
+        if offset >= len(data):
+            raise ValueError('Missing the trailing 0x3B.')
+        block = data[offset]
+        if block == 0x3B:
+            return
+
+        if block == 0x21:
+            # extension blocks, the graphics control block included, are skipped
+            _, offset = _read_sub_blocks(data, offset + 2)
+            continue
+
+        if block != 0x2C:
+            raise ValueError('Unknown block 0x{:02X} at offset {}.'.format(block, offset))
+
+        start = offset
+        left, top, width, height, byte = unpack_from('<4HB', data, offset + 1)
+        offset += 10
+        if byte & 0b01000000:
+            raise ValueError('Interlaced frames are not supported.')
+        palette = global_palette
+        if byte & 0b10000000:
+            size = 3 << ((byte & 0b111) + 1)
+            palette = bytes(data[offset:offset + size])
+            offset += size
+        if palette is None:
+            raise ValueError('Missing color table.')
+
+        mcl = data[offset]
+        compressed, offset = _read_sub_blocks(data, offset + 1)
+        pixels = lzw_decompress(compressed, mcl)
+        if len(pixels) < width * height:
+            raise ValueError('Truncated image data.')
+        yield Frame(left, top, width, height, palette, bytes(pixels[:width * height]), start, offset - start)
+
+
+def _read_sub_blocks(data, offset):
+    """
+    Join the data sub-blocks starting at `offset`, each one preceded by its length.
+    Return the joined bytes and the offset after the block terminator.
+    """
+    chunks = []
+    while True:
+        if offset >= len(data):
+            raise ValueError('Truncated data sub-blocks.')
+        size = data[offset]
+        offset += 1
+        if size == 0:
+            return b''.join(chunks), offset
+        chunks.append(bytes(data[offset:offset + size]))
+        offset += size
+
+
+def lzw_decompress(compressed, mcl):
+    """
+    The inverse of `GIFencoder.lzw_compress`.
+
+    `compressed`: the LZW codes, packed least significant bit first,
+         with the data sub-blocks already joined.
+
+    `mcl`: minimum code length of the compressed data.
+
+    Return the color indices as a bytearray.
+    """
+    if not 2 <= mcl <= 8:
+        raise ValueError('Bad minimum code length: ' + str(mcl))
+    clear_code = (1 << mcl)
+    end_code = clear_code + 1
+    max_codes = 4096
+
+    roots = [bytes([i]) for i in range(clear_code)] + [b'', b'']
+    table = list(roots)
+    code_length = mcl + 1
+    next_code = end_code + 1
+    previous = None
+
+    output = bytearray()
+    acc = 0  # pending bits, the oldest one is the least significant
+    nbits = 0
+    data = iter(compressed)
+    while True:
+        while nbits < code_length:
+            byte = next(data, None)
+            if byte is None:
+                return output  # no end code, keep what has been decoded
+            acc |= byte << nbits
+            nbits += 8
+        code = acc & ((1 << code_length) - 1)
+        acc >>= code_length
+        nbits -= code_length
+
+        if code == clear_code:
+            table = list(roots)
+            code_length = mcl + 1
+            next_code = end_code + 1
+            previous = None
+            continue
+        if code == end_code:
+            return output
+
+        if previous is None:
+            if code >= clear_code:
+                raise ValueError('Bad LZW code: ' + str(code))
+            entry = table[code]
+        elif code < next_code:
+            entry = table[code]
+            if next_code < max_codes:
+                table.append(previous + entry[:1])
+                next_code += 1
+        elif code == next_code:
+            # the code being defined, its pattern starts and ends with the same color
+            entry = previous + previous[:1]
+            if next_code < max_codes:
+                table.append(entry)
+                next_code += 1
+        else:
+            raise ValueError('Bad LZW code: ' + str(code))
+
+        if next_code == 1 << code_length and code_length < 12:
+            code_length += 1
+        output += entry
+        previous = entry
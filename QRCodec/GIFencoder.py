@@ -123,58 +123,60 @@ class DataBlock(object):
     """
 
     def __init__(self):
-        self._bitstream = bytearray()  # write bits into this array
-        self._nbits = 0  # a counter holds how many bits have been written
+        self._bitstream = bytearray()  # whole bytes that have been flushed
+        self._acc = 0  # pending bits, the oldest one is the least significant
+        self._nbits = 0  # a counter holds how many bits are pending in `_acc`
 
     def encode_bits(self, num, size):
         """
-        Given a number `num`, encode it as a binary string of length `size`,
-        and pack it at the end of bitstream.
-        Example: num = 3, size = 5. The binary string for 3 is '00011' (it's
-        '0b00011' in python), here we padded extra zeros at the left to make
-        its length to be 5. The tricky part is that in a gif file, the encoded
-        binary data stream increases from lower (least significant) bits to higher
-        (most significant) bits, so we have to reverse it as '11000' and pack
-        this string at the end of bitstream!
+        Pack the lowest `size` bits of `num` at the end of bitstream.
+        In a gif file the encoded binary data stream increases from lower
+        (least significant) bits to higher (most significant) bits, so the
+        new code is simply shifted above the bits still pending in the
+        accumulator, and every completed byte is flushed to the bytearray.
+        Example: num = 3, size = 5 with 6 bits pending appends '00011' above
+        them and flushes one byte, leaving 3 bits pending.
         """
-        string = bin(num)[2:].zfill(size)
-        for digit in reversed(string):
-            if len(self._bitstream) * 8 == self._nbits:
-                self._bitstream.append(0)
-            if digit == '1':
-                self._bitstream[-1] |= 1 << (self._nbits % 8)
-            self._nbits += 1
+        acc = self._acc | (num << self._nbits)
+        nbits = self._nbits + size
+        while nbits >= 8:
+            self._bitstream.append(acc & 0xFF)
+            acc >>= 8
+            nbits -= 8
+        self._acc = acc
+        self._nbits = nbits
 
     def dump_bytes(self):
         """
         Pack the LZW encoded image data into blocks.
         Each block is of length <= 255 and is preceded by a byte
         in 0-255 that indicates the length of this block.
-        Each time after this function is called `_nbits` and
+        Each time after this function is called the pending bits and
         `_bitstream` are reset to 0 and empty.
         """
+        if self._nbits > 0:
+            self._bitstream.append(self._acc)
+        bitstream = memoryview(self._bitstream)
+        size = len(bitstream)
         bytestream = bytearray()
-        while len(self._bitstream) > 255:
-            bytestream.append(255)
-            bytestream.extend(self._bitstream[:255])
-            self._bitstream = self._bitstream[255:]
-        if len(self._bitstream) > 0:
-            bytestream.append(len(self._bitstream))
-            bytestream.extend(self._bitstream)
+        for start in range(0, size, 255):
+            block = bitstream[start:start + 255]
+            bytestream.append(len(block))
+            bytestream += block
+        bitstream.release()
 
+        self._acc = 0
         self._nbits = 0
         self._bitstream = bytearray()
         return bytestream
 
 
-stream = DataBlock()
-
-
 def lzw_compress(input_data, mcl):
     """
     The Lempel-Ziv-Welch compression algorithm used in the GIF89a specification.
 
-    `input_data`: a 1-d list consists of integers in range [0, 255],
+    `input_data`: an iterable of integers in range [0, 255] (a list, `bytes`
+         or any buffer iterating as ints),
          these integers are the indices of the colors of the pixels
          in the global color table. We do not check the validity of
          this input data here for efficiency.
@@ -197,31 +199,46 @@ def lzw_compress(input_data, mcl):
 
     code_length = mcl + 1
     next_code = end_code + 1
-    # the default initial dict
-    code_table = {(i,): i for i in range(1 << mcl)}
+    # the code table is keyed by the integer pair (prefix_code, next_symbol)
+    # packed as `prefix_code << 8 | next_symbol`, the single color codes
+    # `0 .. (1 << mcl) - 1` are implicit and never stored.
+    code_table = {}
+    # every call owns its bit stream so that frames can be compressed
+    # concurrently in threads.
+    stream = DataBlock()
+    write = stream.encode_bits
     # output the clear code
-    stream.encode_bits(clear_code, code_length)
-
-    pattern = tuple()
-    for c in input_data:
-        pattern += (c,)
-        if pattern not in code_table:
-            # add new code to the table
-            code_table[pattern] = next_code
-            # output the prefix
-            stream.encode_bits(code_table[pattern[:-1]], code_length)
-            pattern = (c,)  # suffix becomes the current pattern
-
-            next_code += 1
-            if next_code == 2**code_length + 1:
-                code_length += 1
-
-            if next_code == max_codes:
-                next_code = end_code + 1
-                stream.encode_bits(clear_code, code_length)
-                code_length = mcl + 1
-                code_table = {(i,): i for i in range(1 << mcl)}
-
-    stream.encode_bits(code_table[pattern], code_length)
-    stream.encode_bits(end_code, code_length)
+    write(clear_code, code_length)
+
+    data = iter(input_data)
+    prefix = next(data, None)
+    if prefix is None:
+        write(end_code, code_length)
+        return bytearray([mcl]) + stream.dump_bytes() + bytearray([0])
+
+    for c in data:
+        key = prefix << 8 | c
+        code = code_table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        # add new code to the table
+        code_table[key] = next_code
+        # output the prefix
+        write(prefix, code_length)
+        prefix = c  # suffix becomes the current pattern
+
+        next_code += 1
+        if next_code == 2**code_length + 1:
+            code_length += 1
+
+        if next_code == max_codes:
+            next_code = end_code + 1
+            write(clear_code, code_length)
+            code_length = mcl + 1
+            code_table = {}
+
+    write(prefix, code_length)
+    write(end_code, code_length)
     return bytearray([mcl]) + stream.dump_bytes() + bytearray([0])
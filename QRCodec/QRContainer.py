@@ -0,0 +1,448 @@
+"""
+The framed container format of `QRCodec`.
+
+Every frame carries a header in front of its chunk:
+
+    magic b'QG', format version, kind, file id, frame index, total frames,
+    CRC32 of the fields before it and the chunk
+
+packed little-endian in 20 bytes and written in the encoding of the frame
+(base64, base32, or as they are in 'bin' mode) so the frame stays in the
+QR mode of its chunk. After the data frames comes a trailer frame whose
+chunk holds the size and the SHA-256 of the whole file.
+
+Optionally parity frames follow. The data frames are dealt round-robin
+into groups, and every group gets Reed-Solomon parity frames (see
+`Erasure`), so any k of the k + m frames of a group rebuild it. A parity
+chunk starts with the number of groups, its group, its parity index and
+the file size, so the file can be rebuilt without the trailer too.
+
+The data chunks hold whole base64/base32 groups, so every frame decodes on
+its own to a known offset of the file. The frames can then be written in
+any order, duplicates skipped and missing ones listed.
+"""
+from struct import Struct
+import base64
+import hashlib
+import math
+import zlib
+import Erasure
+
+
+__all__ = ['header_length', 'chunk_length', 'frame_count', 'longest_frame', 'group_count', 'pack_frame', 'pack_trailer',
+           'pack_parity', 'ParityEncoder', 'iter_parity', 'unpack_frame', 'has_header', 'FrameWriter']
+
+
+HEADER = Struct('<2sBBIIII')
+TRAILER = Struct('<Q32s')  # file size, SHA-256
+PARITY = Struct('<HHBQ2x')  # number of groups, group, parity index, file size. 15 bytes, whole groups
+MAGIC = b'QG'
+FORMAT_VERSION = 1
+KIND_DATA = 0
+KIND_TRAILER = 1
+KIND_PARITY = 2
+MAX_GROUP = 128  # data frames per group, leaves room for as many parity frames
+
+# characters of one base64/base32 group, and the bytes it decodes to
+GROUPS = {'b64': (4, 3), 'b32': (8, 5), 'bin': (1, 1)}
+
+
+def _check_mode(mode):
+    if mode not in GROUPS:
+        raise ValueError('unknown mode: ' + str(mode))
+
+
+def _encode(data, mode):
+    if mode == 'b64':
+        return base64.b64encode(data).decode()
+    if mode == 'b32':
+        return base64.b32encode(data).decode().replace('=', '$')  # alphanumeric does not support equal sign
+    return data
+
+
+def _decode(data, mode):
+    if mode == 'b64':
+        return base64.b64decode(data, validate=True)
+    if mode == 'b32':
+        return base64.b32decode(data.replace(b'$', b'='))
+    return data
+
+
+def header_length(mode):
+    """
+    Length of the encoded header, in characters, or bytes in 'bin' mode.
+    """
+    _check_mode(mode)
+    return len(_encode(bytes(HEADER.size), mode))
+
+
+def chunk_length(frame_length, mode, fec=False):
+    """
+    The length of the data chunk in a frame of `frame_length` characters,
+    header excluded, rounded down to whole base64/base32 groups.
+    With `fec` the room for the parity fields is left too, so that a parity
+    chunk fits the same frames.
+    """
+    group = GROUPS[mode][0]
+    if frame_length < header_length(mode) + len(_encode(bytes(TRAILER.size), mode)):
+        raise ValueError('Frames of {} characters cannot hold the trailer.'.format(frame_length))
+    if fec:
+        frame_length -= len(_encode(bytes(PARITY.size), mode))
+    length = (frame_length - header_length(mode)) // group * group
+    if length <= 0:
+        raise ValueError('Frames of {} characters cannot hold the header.'.format(frame_length))
+    return length
+
+
+def frame_count(size, length, mode):
+    """
+    The number of data frames a file of `size` bytes takes, `length` characters per chunk.
+    """
+    chars, nbytes = GROUPS[mode]
+    encoded_size = (size + nbytes - 1) // nbytes * chars
+    return (encoded_size + length - 1) // length
+
+
+def longest_frame(size, frame_length, mode, fec=False):
+    """
+    The length of the longest frame of a file of `size` bytes, in frames of `frame_length`
+    characters, header included: a data frame, the trailer or, with `fec`, a parity frame.
+    """
+    length = chunk_length(frame_length, mode, fec)
+    chars, nbytes = GROUPS[mode]
+    data = min(length, (size + nbytes - 1) // nbytes * chars)
+    longest = max(data, len(_encode(bytes(TRAILER.size), mode)))
+    if fec:
+        longest = max(longest, len(_encode(bytes(PARITY.size), mode)) + data)
+    return header_length(mode) + longest
+
+
+def group_count(total, group_size):
+    """
+    The number of parity groups for `total` data frames of at most `group_size` frames each.
+    Frame `i` goes to group `i % group_count`, at position `i // group_count`.
+    """
+    if not 1 <= group_size <= MAX_GROUP:
+        raise ValueError('group_size should be in 1-{}, got {}'.format(MAX_GROUP, group_size))
+    return max(1, (total + group_size - 1) // group_size)
+
+
+def _crc32(kind, file_id, index, total, data):
+    """
+    The CRC32 of a frame, over the header fields and the chunk: a damaged index or total is caught too.
+    """
+    fields = HEADER.pack(MAGIC, FORMAT_VERSION, kind, file_id, index, total, 0)[:-4]
+    return zlib.crc32(data, zlib.crc32(fields))
+
+
+def pack_frame(chunk, file_id, index, total, kind=KIND_DATA, mode='b64'):
+    """
+    Put the header in front of an encoded chunk.
+
+    :param chunk: the chunk string, or bytes in 'bin' mode
+    :return: the frame string, or bytes in 'bin' mode
+    """
+    data = chunk.encode() if isinstance(chunk, str) else chunk
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, kind, file_id, index, total, _crc32(kind, file_id, index, total, data))
+    return _encode(header, mode) + chunk
+
+
+def pack_trailer(size, digest, file_id, total, mode='b64'):
+    """
+    The trailer frame, after the `total` data frames.
+
+    :param size: size of the file
+    :param digest: SHA-256 of the file
+    """
+    return pack_frame(_encode(TRAILER.pack(size, digest), mode), file_id, total, total, KIND_TRAILER, mode)
+
+
+def pack_parity(chunk, n_groups, group, j, size, file_id, index, total, mode='b64'):
+    """
+    A parity frame.
+
+    :param chunk: the parity bytes
+    :param n_groups: number of groups
+    :param group: the group of the parity chunk
+    :param j: the parity index in the group
+    :param size: size of the file
+    :param index: frame index, parity frames are numbered after the trailer
+    """
+    chunk = _encode(PARITY.pack(n_groups, group, j, size) + chunk, mode)
+    return pack_frame(chunk, file_id, index, total, KIND_PARITY, mode)
+
+
+class ParityEncoder(object):
+    """
+    Compute the parity frames of a file as its data chunks go by. The groups are
+    round-robin and the number of data frames is known up front, so each chunk is
+    added to the running parity of its group right away and only the parity is kept,
+    about `ratio` times the size of the file.
+    Call `add()` with every data chunk in order, then `frames()` for the parity frames.
+    """
+    def __init__(self, total, ratio, group_size, size, file_id, mode='b64'):
+        """
+        total: number of data frames.
+        ratio: parity frames per data frame, a group of k frames gets ceil(k * ratio) parity frames.
+        group_size: data frames per group at most.
+        size: size of the file.
+        file_id: the file id of the frames.
+        mode: b64, b32 or bin, the encoding of the frames.
+        """
+        if not 0 < ratio <= 1:
+            raise ValueError('ratio should be in (0, 1], got ' + str(ratio))
+        _check_mode(mode)
+        self.total = total
+        self.size = size
+        self.file_id = file_id
+        self.mode = mode
+        self.n_groups = group_count(total, group_size)
+        self._count = 0
+        self._frame_size = 0  # decoded bytes per frame, from the first chunk
+        self._parity = []  # per group, the running parity chunks as integers
+        for g in range(self.n_groups):
+            k = len(range(g, total, self.n_groups))
+            m = math.ceil(k * ratio)
+            if k + m > Erasure.MAX_CHUNKS:
+                raise ValueError('At most {} data and parity chunks per group, got {}.'.format(Erasure.MAX_CHUNKS, k + m))
+            self._parity.append([0] * m)
+
+    def add(self, chunk):
+        """
+        Add the next data chunk.
+
+        :param chunk: the encoded data chunk, string or bytes in 'bin' mode
+        """
+        if self._count >= self.total:
+            raise ValueError('More than {} data chunks.'.format(self.total))
+        chunk = _decode(chunk.encode() if isinstance(chunk, str) else chunk, self.mode)
+        if not self._count:
+            self._frame_size = len(chunk)
+        g, i = self._count % self.n_groups, self._count // self.n_groups
+        Erasure.accumulate(self._parity[g], i, chunk)
+        self._count += 1
+
+    def frames(self):
+        """
+        :return: generator of the parity frames, every group's first parity frame first
+        """
+        if self._count != self.total:
+            raise ValueError('{} data chunks added out of {}.'.format(self._count, self.total))
+        index = self.total + 1
+        for j in range(max(map(len, self._parity))):
+            for g in range(self.n_groups):
+                if j < len(self._parity[g]):
+                    chunk = self._parity[g][j].to_bytes(self._frame_size, 'little')
+                    yield pack_parity(chunk, self.n_groups, g, j, self.size, self.file_id, index, self.total, self.mode)
+                    index += 1
+
+
+def iter_parity(chunks, ratio, group_size, size, file_id, mode='b64'):
+    """
+    Compute the parity frames of a file, see `ParityEncoder`.
+
+    :param chunks: list of the encoded data chunks, strings or bytes in 'bin' mode
+    :param ratio: parity frames per data frame, a group of k frames gets ceil(k * ratio) parity frames
+    :param group_size: data frames per group at most
+    :param size: size of the file
+    :return: generator of the parity frames, every group's first parity frame first
+    """
+    encoder = ParityEncoder(len(chunks), ratio, group_size, size, file_id, mode)
+    for chunk in chunks:
+        encoder.add(chunk)
+    return encoder.frames()
+
+
+def unpack_frame(data, mode='b64'):
+    """
+    Split the data of a frame into its header fields and chunk.
+    `ValueError` is raised if there is no header or the CRC32 of the header and chunk does not match.
+
+    :param data: the data of the frame as bytes
+    :return: (kind, file_id, index, total, chunk bytes)
+    """
+    n = header_length(mode)
+    header = _decode(bytes(data[:n]), mode)
+    if len(header) != HEADER.size:
+        raise ValueError('Missing frame header.')
+    magic, version, kind, file_id, index, total, crc = HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION or kind not in (KIND_DATA, KIND_TRAILER, KIND_PARITY):
+        raise ValueError('Missing frame header.')
+    chunk = bytes(data[n:])
+    if _crc32(kind, file_id, index, total, chunk) != crc:
+        raise ValueError('CRC32 mismatch in frame {}.'.format(index))
+    return kind, file_id, index, total, chunk
+
+
+def has_header(data, mode='b64'):
+    """
+    Whether the data of a frame starts with a valid header.
+    """
+    try:
+        unpack_frame(data, mode)
+    except ValueError:
+        return False
+    return True
+
+
+class FrameWriter(object):
+    """
+    Write the frames of a framed GIF into an opened file, in whatever order they come.
+    Each chunk is decoded and written at its offset right away. Frames of another file,
+    duplicates and frames that fail their CRC32 are skipped and counted.
+    Call `close()` once all the frames are added to rebuild the missing data frames
+    from the parity frames, if any, and check the file against the trailer.
+    """
+    def __init__(self, f, mode='b64'):
+        """
+        f: the output file, opened in 'wb' mode.
+        mode: b64, b32 or bin, the encoding of the frames.
+        """
+        _check_mode(mode)
+        self._f = f
+        self.mode = mode
+        self.file_id = None
+        self.total = None
+        self.trailer = None
+        self.duplicates = 0
+        self.rejected = 0
+        self.recovered = 0
+        self._seen = None
+        self._seen_parity = set()
+        self._frame_size = None  # decoded bytes per frame, known from any frame but the last
+        self._pending = {}  # frames waiting for `_frame_size`
+        self._size = None  # file size, from the trailer or any parity frame
+        self._n_groups = None
+        self._parity = {}  # (group, parity index) -> parity bytes
+
+    def add(self, data):
+        """
+        Add the data of a frame.
+
+        :param data: the data of the frame as bytes, None for a frame that could not be decoded
+        :return: True if the frame was used
+        """
+        if data is None:
+            self.rejected += 1
+            return False
+        try:
+            kind, file_id, index, total, chunk = unpack_frame(data, self.mode)
+        except ValueError:
+            self.rejected += 1
+            return False
+
+        if self.file_id is None:
+            self.file_id, self.total = file_id, total
+            self._seen = bytearray(total + 1)  # the trailer is frame `total`
+        if file_id != self.file_id or total != self.total or (kind == KIND_PARITY) != (index > total):
+            self.rejected += 1
+            return False
+        if (self._seen[index] if index <= total else index in self._seen_parity):
+            self.duplicates += 1
+            return False
+
+        chunk = _decode(chunk, self.mode)
+        if kind == KIND_PARITY:
+            n_groups, group, j, size = PARITY.unpack(chunk[:PARITY.size])
+            if self._n_groups not in (None, n_groups):
+                self.rejected += 1
+                return False
+            self._seen_parity.add(index)
+            self._n_groups, self._size = n_groups, size
+            self._parity[group, j] = chunk[PARITY.size:]
+            self._set_frame_size(len(chunk) - PARITY.size)
+            return True
+
+        self._seen[index] = 1
+        if kind == KIND_TRAILER:
+            self.trailer = TRAILER.unpack(chunk)
+            self._size = self.trailer[0]
+            return True
+
+        if self._frame_size is None and index == total - 1:
+            self._pending[index] = chunk
+            return True
+        self._set_frame_size(len(chunk))
+        self._write(index, chunk)
+        return True
+
+    def _set_frame_size(self, frame_size):
+        if self._frame_size is not None:
+            return
+        self._frame_size = frame_size
+        for i, c in self._pending.items():
+            self._write(i, c)
+        self._pending.clear()
+
+    def _write(self, index, chunk):
+        self._f.seek(index * self._frame_size)
+        self._f.write(chunk)
+
+    def missing(self):
+        """
+        The indices of the frames not added yet, the trailer included.
+        Parity frames are not listed.
+        """
+        if self._seen is None:
+            return []
+        return [i for i, seen in enumerate(self._seen) if not seen]
+
+    def _recover(self, missing):
+        """
+        Rebuild the missing data frames from the parity frames of their groups.
+        """
+        n_groups, frame_size, total = self._n_groups, self._frame_size, self.total
+        self._f.flush()
+        with open(self._f.name, 'rb') as f:
+            for g in sorted({i % n_groups for i in missing}):
+                members = range(g, total, n_groups)
+                parities = {j: c for (group, j), c in self._parity.items() if group == g}
+                if sum(not self._seen[i] for i in members) > len(parities):
+                    continue  # not enough parity frames, the missing ones are listed by `close()`
+                data = {}
+                for position, i in enumerate(members):
+                    if self._seen[i]:
+                        f.seek(i * frame_size)
+                        data[position] = f.read(frame_size).ljust(frame_size, b'\x00')
+                for position, chunk in Erasure.recover(len(members), data, parities).items():
+                    i = members[position]
+                    if i == total - 1:
+                        chunk = chunk[:self._size - i * frame_size]
+                    self._write(i, chunk)
+                    self._seen[i] = 1
+                    self.recovered += 1
+
+    def close(self):
+        """
+        Check that every frame arrived, or can be rebuilt from the parity frames, and that the
+        file matches the size and SHA-256 of the trailer, `ValueError` is raised otherwise.
+        A file rebuilt without its trailer is only checked against the size of the parity frames.
+        """
+        if self.file_id is None:
+            raise ValueError('No framed data.')
+        missing = [i for i in self.missing() if i < self.total]
+        if missing and self._parity:
+            self._recover(missing)
+        missing = self.missing()
+        if self.trailer is None and self._parity and self.total in missing:
+            missing.remove(self.total)  # the parity frames know the size
+        if missing:
+            raise ValueError('Missing frames: ' + ', '.join(map(str, missing)))
+        for i, c in self._pending.items():  # a single data frame
+            self._f.seek(0)
+            self._f.write(c)
+        self._pending.clear()
+
+        size, digest = self.trailer or (self._size, None)
+        self._f.flush()
+        self._f.seek(0, 2)
+        if self._f.tell() != size:
+            raise ValueError('File size mismatch, {} instead of {} bytes.'.format(self._f.tell(), size))
+        if digest is None:
+            return
+        with open(self._f.name, 'rb') as f:
+            sha256 = hashlib.sha256()
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(block)
+        if sha256.digest() != digest:
+            raise ValueError('SHA-256 mismatch.')
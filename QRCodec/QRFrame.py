@@ -0,0 +1,508 @@
+"""
+A fixed-layout QR frame builder.
+
+For a fixed version and error correction level, every QR code shares its
+function patterns (finder, separator, timing and alignment patterns,
+version information) and the order in which the data modules are placed.
+`QRFrameBuilder` computes those once, so every frame only has to run the
+Reed-Solomon step, apply the masks and score them.
+
+The matrices are identical to the ones `qrcode.QRCode.get_matrix` returns
+for the same data, version and error correction level.
+"""
+from collections import OrderedDict
+from operator import itemgetter
+from qrcode import util
+import qrcode
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the builder falls back to the pure python masking
+    np = None
+
+
+# the 1:1:3:1:1 finder-like patterns, preceded or followed by 4 light modules
+FINDER_LIKE_PATTERNS = ((1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0),
+                        (0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1))
+
+_rs_products = {}
+
+
+def rs_products(ec_count):
+    """
+    For each factor 0-255, the Reed-Solomon generator polynomial of degree `ec_count`
+    times that factor, leading term excluded, packed into an integer.
+    """
+    if ec_count not in _rs_products:
+        poly = qrcode.base.Polynomial([1], 0)
+        for i in range(ec_count):
+            poly = poly * qrcode.base.Polynomial([1, qrcode.base.gexp(i)], 0)
+        gen_log = [qrcode.base.glog(c) for c in list(poly)[1:]]
+        products = [0]
+        for factor in range(1, 256):
+            f = qrcode.base.glog(factor)
+            products.append(int.from_bytes(bytes(qrcode.base.gexp(f + g) for g in gen_log), 'big'))
+        _rs_products[ec_count] = products
+    return _rs_products[ec_count]
+
+
+def rs_remainder(dc, ec_count):
+    """
+    The Reed-Solomon error correction codewords of the data codewords `dc`, as an integer.
+    The remainder is shifted through an integer, one byte per data codeword.
+    """
+    products = rs_products(ec_count)
+    shift = 8 * (ec_count - 1)
+    mask = (1 << (8 * ec_count)) - 1
+    remainder = 0
+    for byte in dc:
+        remainder = ((remainder << 8) & mask) ^ products[byte ^ (remainder >> shift)]
+    return remainder
+
+
+def create_data(version, error_correction, data_list, rs_blocks=None):
+    """
+    Same as `qrcode.util.create_data`, with the Reed-Solomon step of `rs_remainder`.
+    qrcode's polynomial division fails on a block of zeros, which the raw bytes of sparse files make.
+
+    :param version: QR code version, 1-40
+    :param error_correction: one of the qrcode.constants.ERROR_CORRECT_* levels
+    :param data_list: list of `qrcode.util.QRData`
+    :param rs_blocks: the `qrcode.base.rs_blocks` of the version and level, looked up if None
+    :return: list of codewords
+    """
+    if rs_blocks is None:
+        rs_blocks = qrcode.base.rs_blocks(version, error_correction)
+    buffer = util.BitBuffer()
+    for data in data_list:
+        buffer.put(data.mode, 4)
+        buffer.put(len(data), util.length_in_bits(data.mode, version))
+        data.write(buffer)
+
+    bit_limit = sum(block.data_count * 8 for block in rs_blocks)
+    if len(buffer) > bit_limit:
+        raise qrcode.exceptions.DataOverflowError(
+            "Code length overflow. Data size (%s) > size available (%s)" % (len(buffer), bit_limit))
+    # the terminator, up to four 0s, and the padding to a whole byte
+    for _ in range(min(bit_limit - len(buffer), 4)):
+        buffer.put_bit(False)
+    if len(buffer) % 8:
+        for _ in range(8 - len(buffer) % 8):
+            buffer.put_bit(False)
+    codewords = bytes(buffer.buffer) + bytes([util.PAD0, util.PAD1]) * ((bit_limit - len(buffer)) // 16 + 1)
+
+    dc_blocks, ec_blocks = [], []
+    offset = 0
+    for block in rs_blocks:
+        dc = codewords[offset:offset + block.data_count]
+        offset += block.data_count
+        ec_count = block.total_count - block.data_count
+        dc_blocks.append(dc)
+        ec_blocks.append(rs_remainder(dc, ec_count).to_bytes(ec_count, 'big'))
+
+    data = []
+    for blocks in (dc_blocks, ec_blocks):
+        for i in range(max(map(len, blocks))):
+            data += [block[i] for block in blocks if i < len(block)]
+    return data
+
+
+class QRFrameBuilder(object):
+    """
+    Build QR matrices of a fixed version and error correction level.
+    The builder keeps no per frame state, one instance can be shared by threads.
+    """
+    def __init__(self, version, error_correction, border=2, vectorize=None, mask_pattern=None):
+        """
+        :param version: QR code version, 1-40
+        :param error_correction: one of the qrcode.constants.ERROR_CORRECT_* levels
+        :param border: width of the light border around the matrix, in modules
+        :param vectorize: mask and score with NumPy, defaults to True when NumPy is installed
+        :param mask_pattern: use this mask pattern, 0-7, for every frame instead of scoring
+            all 8 of them. None picks the best mask of each frame like `qrcode` does.
+        """
+        if mask_pattern is not None and mask_pattern not in range(8):
+            raise ValueError('mask_pattern should be in range(8), got ' + str(mask_pattern))
+        self.mask_pattern = mask_pattern
+        if vectorize is None:
+            vectorize = np is not None
+        if vectorize and np is None:
+            raise ValueError('NumPy is required for the vectorized frame builder.')
+        self.vectorize = vectorize
+        self.version = version
+        self.error_correction = error_correction
+        self.border = border
+        self._rs_blocks = qrcode.base.rs_blocks(version, error_correction)
+
+        qr = qrcode.QRCode(version=version, error_correction=error_correction, box_size=1, border=border)
+        size = qr.modules_count = version * 4 + 17
+        self.size = size
+
+        # function patterns, with the format and version information left light
+        # as `qrcode` has them while it scores the masks
+        qr.modules = [[None] * size for _ in range(size)]
+        qr.setup_position_probe_pattern(0, 0)
+        qr.setup_position_probe_pattern(size - 7, 0)
+        qr.setup_position_probe_pattern(0, size - 7)
+        qr.setup_position_adjust_pattern()
+        qr.setup_timing_pattern()
+        qr.setup_type_info(True, 0)
+        if version >= 7:
+            qr.setup_type_number(True)
+        self._test_template = [row[:] for row in qr.modules]
+
+        # the data modules, in placement order
+        self._positions = self._placement_order(qr.modules, size)
+
+        # the template of the final matrix carries the version information and the dark module
+        qr.modules[size - 8][8] = True
+        if version >= 7:
+            qr.setup_type_number(False)
+        self._template = [row[:] for row in qr.modules]
+
+        # the format information cells of every mask pattern
+        self._type_info = []
+        for mask_pattern in range(8):
+            qr.setup_type_info(False, mask_pattern)
+            self._type_info.append([(r, c, qr.modules[r][c]) for (r, c) in self._type_info_cells(size)])
+
+        # for each mask pattern, which data modules it flips
+        self._masks = []
+        for mask_pattern in range(8):
+            mask_func = util.mask_func(mask_pattern)
+            self._masks.append([mask_func(r, c) for (r, c) in self._positions])
+
+        if vectorize:
+            self._rows = np.array([r for (r, _) in self._positions], dtype=np.intp)
+            self._cols = np.array([c for (_, c) in self._positions], dtype=np.intp)
+            self._masks = np.array(self._masks, dtype=bool)
+            self._test_template = np.array(self._test_template, dtype=bool)
+            self._template = np.array(self._template, dtype=bool)
+
+    @staticmethod
+    def _placement_order(modules, size):
+        """
+        Walk the matrix in the zigzag order of `qrcode.QRCode.map_data`
+        and list the cells not taken by a function pattern.
+        """
+        positions = []
+        inc = -1
+        row = size - 1
+        for col in range(size - 1, 0, -2):
+            if col <= 6:
+                col -= 1
+            while True:
+                for c in (col, col - 1):
+                    if modules[row][c] is None:
+                        positions.append((row, c))
+                row += inc
+                if row < 0 or size <= row:
+                    row -= inc
+                    inc = -inc
+                    break
+        return positions
+
+    @staticmethod
+    def _type_info_cells(size):
+        """
+        The cells of the two copies of the format information.
+        """
+        cells = [(i, 8) for i in range(6)] + [(7, 8), (8, 8)] + [(size - 15 + i, 8) for i in range(8, 15)]
+        cells += [(8, size - i - 1) for i in range(8)] + [(8, 7)] + [(8, 15 - i - 1) for i in range(9, 15)]
+        return cells
+
+    def data_bits(self, s):
+        """
+        Encode `s` the way `qrcode.QRCode.add_data` does and return the codewords,
+        the Reed-Solomon error correction included.
+
+        :param s: the string or bytes to encode, or a `qrcode.util.QRData` taken as it is
+        :return: list of codewords
+        """
+        if isinstance(s, util.QRData):
+            data_list = [s]
+        else:
+            data_list = list(util.optimal_data_chunks(s, minimum=20))
+        return create_data(self.version, self.error_correction, data_list, self._rs_blocks)
+
+    def _bits(self, codewords):
+        """
+        Spread the codewords over the data modules, most significant bit first.
+        The modules left over are light.
+        """
+        n_bits = len(self._positions)
+        if self.vectorize:
+            bits = np.unpackbits(np.array(codewords, dtype=np.uint8))[:n_bits].astype(bool)
+            if len(bits) < n_bits:
+                bits = np.concatenate([bits, np.zeros(n_bits - len(bits), dtype=bool)])
+            return bits
+        bits = [bool((codewords[i >> 3] >> (7 - (i & 7))) & 1) for i in range(min(n_bits, len(codewords) * 8))]
+        return bits + [False] * (n_bits - len(bits))
+
+    def _best_mask_pattern(self, bits):
+        if self.vectorize:
+            # score all 8 masks at once
+            candidates = np.repeat(self._test_template[np.newaxis], 8, axis=0)
+            candidates[:, self._rows, self._cols] = bits ^ self._masks
+            return int(np.argmin(self.lost_points(candidates)))
+
+        best, mask_pattern = None, 0
+        for i in range(8):
+            modules = [row[:] for row in self._test_template]
+            for (r, c), bit, flip in zip(self._positions, bits, self._masks[i]):
+                modules[r][c] = bit != flip
+            lost_point = util.lost_point(modules)
+            if best is None or lost_point < best:
+                best, mask_pattern = lost_point, i
+        return mask_pattern
+
+    def best_mask_pattern(self, s):
+        """
+        The mask pattern `qrcode` would choose for `s`.
+
+        :param s: the string or bytes to encode
+        :return: mask pattern, 0-7
+        """
+        return self._best_mask_pattern(self._bits(self.data_bits(s)))
+
+    def get_matrix(self, s):
+        """
+        Build the QR matrix of `s`, border included, with the pinned `mask_pattern`,
+        or the one `qrcode` would choose if there is none.
+
+        :param s: the string or bytes to encode
+        :return: the matrix, a 2-d NumPy bool array if vectorized, else a list of lists
+        """
+        bits = self._bits(self.data_bits(s))
+        mask_pattern = self.mask_pattern
+        if mask_pattern is None:
+            mask_pattern = self._best_mask_pattern(bits)
+
+        if self.vectorize:
+            modules = self._template.copy()
+            modules[self._rows, self._cols] = bits ^ self._masks[mask_pattern]
+            for r, c, mod in self._type_info[mask_pattern]:
+                modules[r, c] = mod
+            return np.pad(modules, self.border, constant_values=False)
+
+        modules = [row[:] for row in self._template]
+        for (r, c), bit, flip in zip(self._positions, bits, self._masks[mask_pattern]):
+            modules[r][c] = bit != flip
+        for r, c, mod in self._type_info[mask_pattern]:
+            modules[r][c] = mod
+
+        if not self.border:
+            return modules
+        x_border = [False] * self.border
+        width = self.size + 2 * self.border
+        code = [[False] * width for _ in range(self.border)]
+        code += [x_border + row + x_border for row in modules]
+        code += [[False] * width for _ in range(self.border)]
+        return code
+
+    @staticmethod
+    def lost_points(candidates):
+        """
+        The mask penalty of `qrcode.util.lost_point`, for a stack of matrices.
+
+        :param candidates: 3-d bool array, one square matrix per mask pattern
+        :return: list of the penalty of each matrix
+        """
+        size = candidates.shape[-1]
+        lost = np.zeros(len(candidates), dtype=np.int64)
+        for a in (candidates, candidates.transpose(0, 2, 1)):
+            # runs of 5 + k same colored modules in a row cost 3 + k,
+            # counted as one per window of 5 plus 2 per run
+            same = a[:, :, 1:] == a[:, :, :-1]
+            window = same[:, :, :-3] & same[:, :, 1:-2] & same[:, :, 2:-1] & same[:, :, 3:]
+            starts = window.copy()
+            starts[:, :, 1:] &= ~same[:, :, :-4]
+            lost += window.sum(axis=(1, 2)) + 2 * starts.sum(axis=(1, 2))
+
+            # finder-like patterns
+            for pattern in FINDER_LIKE_PATTERNS:
+                match = np.ones(a.shape[:2] + (size - 10,), dtype=bool)
+                for i, dark in enumerate(pattern):
+                    cells = a[:, :, i:size - 10 + i]
+                    match &= cells if dark else ~cells
+                lost += 40 * match.sum(axis=(1, 2))
+
+        # 2x2 blocks of the same color
+        block = ((candidates[:, :-1, :-1] == candidates[:, 1:, :-1]) &
+                 (candidates[:, :-1, :-1] == candidates[:, :-1, 1:]) &
+                 (candidates[:, :-1, :-1] == candidates[:, 1:, 1:]))
+        lost += 3 * block.sum(axis=(1, 2))
+
+        # every 5% departure from 50% dark modules
+        lost_points = []
+        for points, dark_count in zip(lost.tolist(), candidates.sum(axis=(1, 2)).tolist()):
+            percent = float(dark_count) / (size ** 2)
+            lost_points.append(points + int(abs(percent * 100 - 50) / 5) * 10)
+        return lost_points
+
+
+# the builders of this process, by their settings, the most recent last, see get_builder
+_builders = OrderedDict()
+_builders_lock = threading.Lock()  # the threads of a thread pool share them
+MAX_BUILDERS = 8
+
+
+def get_builder(version, error_correction, border=2, mask_pattern=None):
+    """
+    The `QRFrameBuilder` of these settings, built once per process and shared.
+    The `MAX_BUILDERS` most recently used are kept.
+
+    :param version: QR code version, 1-40
+    :param error_correction: one of the qrcode.constants.ERROR_CORRECT_* levels
+    :param border: width of the light border around the matrix, in modules
+    :param mask_pattern: see `QRFrameBuilder`
+    :return: QRFrameBuilder
+    """
+    key = (version, error_correction, border, mask_pattern)
+    with _builders_lock:
+        if key not in _builders:
+            _builders[key] = QRFrameBuilder(version, error_correction, border=border, mask_pattern=mask_pattern)
+            while len(_builders) > MAX_BUILDERS:
+                _builders.popitem(last=False)
+        _builders.move_to_end(key)
+        return _builders[key]
+
+
+# the alphanumeric mode character set
+ALPHA_NUM = b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+
+# maps the bytes 0 and 1 to the characters '0' and '1'
+BIT_CHARS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+class QRFrameReader(object):
+    """
+    Read the data back from the module matrix of an axis aligned QR code,
+    such as the frames `QRFrameBuilder` and `qrcode` produce. Nothing is located
+    or sampled, so this only works on matrices of 1 pixel per module.
+    The Reed-Solomon codewords are checked but not used to correct errors,
+    a matrix that fails the check raises `ValueError`.
+    """
+    def __init__(self):
+        self._layouts = {}
+        # every valid format information, mapped to its (error correction, mask pattern)
+        self._type_info = {util.BCH_type_info(error_correction << 3 | mask_pattern): (error_correction, mask_pattern)
+                           for error_correction in range(4) for mask_pattern in range(8)}
+
+    def _layout(self, version):
+        """
+        A getter of the data module cells of a version out of the flattened matrix,
+        their count, and for each mask pattern the bits it flips, packed into an integer.
+        The cells do not depend on the error correction level.
+        """
+        if version not in self._layouts:
+            builder = QRFrameBuilder(version, 0, border=0, vectorize=False)
+            cells = itemgetter(*[r * builder.size + c for (r, c) in builder._positions])
+            masks = [int(''.join('1' if flip else '0' for flip in mask), 2) for mask in builder._masks]
+            self._layouts[version] = (cells, len(builder._positions), masks)
+        return self._layouts[version]
+
+    @staticmethod
+    def _check_block(dc, ec):
+        """
+        Recompute the error correction codewords of a block and compare.
+        """
+        return rs_remainder(dc, len(ec)) == int.from_bytes(ec, 'big')
+
+    def decode(self, matrix, info=False):
+        """
+        Decode a QR matrix with its light border.
+
+        :param matrix: square matrix, a sequence of rows where dark modules are truthy
+        :param info: also return what the matrix was made with
+        :return: the data as bytes, or (data, version, error correction, mask pattern) with `info`
+        """
+        n = len(matrix)
+        border = next((i for i in range(n) if matrix[i][i]), n)
+        size = n - 2 * border
+        version, rest = divmod(size - 17, 4)
+        if rest or not 1 <= version <= 40 or any(len(row) != n for row in matrix):
+            raise ValueError('Not a QR matrix.')
+        modules = [row[border:border + size] for row in matrix[border:border + size]]
+
+        # the format information, from whichever copy is intact
+        cells = QRFrameBuilder._type_info_cells(size)
+        for copy_cells in (cells[:15], cells[15:]):
+            bits = sum(1 << i for i, (r, c) in enumerate(copy_cells) if modules[r][c])
+            if bits in self._type_info:
+                error_correction, mask_pattern = self._type_info[bits]
+                break
+        else:
+            raise ValueError('Bad format information.')
+
+        cells, n_bits, masks = self._layout(version)
+        blocks = qrcode.base.rs_blocks(version, error_correction)
+        n_codewords = sum(block.total_count for block in blocks)
+        # the data modules in placement order as a string of '0' and '1', unmasked as one integer
+        flat = b''.join(bytes(map(bool, row)) for row in modules).translate(BIT_CHARS)
+        bits = int(bytes(cells(flat)), 2) ^ masks[mask_pattern]
+        codewords = (bits >> (n_bits - n_codewords * 8)).to_bytes(n_codewords, 'big')
+
+        # undo the interleaving of the blocks
+        dcdata = [bytearray() for _ in blocks]
+        ecdata = [bytearray() for _ in blocks]
+        offset = 0
+        for i in range(max(block.data_count for block in blocks)):
+            for block, dc in zip(blocks, dcdata):
+                if i < block.data_count:
+                    dc.append(codewords[offset])
+                    offset += 1
+        for i in range(max(block.total_count - block.data_count for block in blocks)):
+            for block, ec in zip(blocks, ecdata):
+                if i < block.total_count - block.data_count:
+                    ec.append(codewords[offset])
+                    offset += 1
+        if not all(self._check_block(dc, ec) for dc, ec in zip(dcdata, ecdata)):
+            raise ValueError('Reed-Solomon check failed.')
+
+        data = self._parse_segments(b''.join(dcdata), version)
+        return (data, version, error_correction, mask_pattern) if info else data
+
+    @staticmethod
+    def _parse_segments(data, version):
+        """
+        Read the data segments of the data codewords, until the terminator.
+        """
+        value = int.from_bytes(data, 'big')
+        n_bits = len(data) * 8
+        pos = 0
+
+        def read(size):
+            nonlocal pos
+            if pos + size > n_bits:
+                raise ValueError('Truncated data segment.')
+            pos += size
+            return (value >> (n_bits - pos)) & ((1 << size) - 1)
+
+        output = bytearray()
+        while n_bits - pos >= 4:
+            mode = read(4)
+            if mode == 0:
+                break  # terminator
+            if mode not in (util.MODE_NUMBER, util.MODE_ALPHA_NUM, util.MODE_8BIT_BYTE):
+                raise ValueError('Unsupported data mode: ' + str(mode))
+            length = read(util.length_in_bits(mode, version))
+
+            if mode == util.MODE_8BIT_BYTE:
+                output += read(8 * length).to_bytes(length, 'big')
+            elif mode == util.MODE_ALPHA_NUM:
+                for _ in range(length // 2):
+                    pair = read(11)
+                    output.append(ALPHA_NUM[pair // 45])
+                    output.append(ALPHA_NUM[pair % 45])
+                if length % 2:
+                    output.append(ALPHA_NUM[read(6)])
+            else:
+                for _ in range(length // 3):
+                    output += b'%03d' % read(10)
+                if length % 3 == 2:
+                    output += b'%02d' % read(7)
+                elif length % 3 == 1:
+                    output += b'%d' % read(4)
+        return bytes(output)
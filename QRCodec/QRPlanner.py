@@ -0,0 +1,124 @@
+"""
+Pick the QR version, error correction level and chunk length of an encoding.
+
+The capacity of a version comes from qrcode's tables: base64 chunks and raw
+bytes are counted as one byte mode segment, base32 chunks as one alphanumeric
+segment. qrcode may split a chunk into several segments, but only where that
+takes fewer bits, so a chunk of the capacity always fits.
+
+The costs are estimates, per frame, in modules of the frame, border included:
+rendering a frame takes about 1.5us per module plus the dispatch to the pool,
+and a frame takes 0.15-0.18 bytes per module in the GIF, measured on random payloads.
+"""
+from collections import namedtuple
+import math
+from qrcode import constants
+from qrcode import util
+import QRContainer
+
+
+__all__ = ['Plan', 'capacity', 'frame_total', 'frame_work', 'plan']
+
+
+Plan = namedtuple('Plan', ['version', 'error_correction', 'chuck_length', 'frames', 'gif_size'])
+
+# from the least to the most robust
+EC_LEVELS = [constants.ERROR_CORRECT_L, constants.ERROR_CORRECT_M, constants.ERROR_CORRECT_Q, constants.ERROR_CORRECT_H]
+
+FRAME_OVERHEAD = 400  # the dispatch of a frame, in modules rendered in the same time
+GIF_BYTES_PER_MODULE = 0.18
+GIF_FRAME_BYTES = 8  # the graphics control block
+GIF_FILE_BYTES = 32  # header, screen descriptor, palette and trailer
+
+
+def capacity(version, error_correction, mode='b64'):
+    """
+    The longest chunk a frame of `version` holds.
+
+    :param version: QR version, 1-40
+    :param error_correction: qrcode.constants.ERROR_CORRECT_*
+    :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+    :return: characters of the chunk, bytes in 'bin' mode
+    """
+    bits = util.BIT_LIMIT_TABLE[error_correction][version]
+    if mode in ('b64', 'bin'):
+        return (bits - 4 - util.length_in_bits(util.MODE_8BIT_BYTE, version)) // 8
+    if mode == 'b32':
+        bits -= 4 + util.length_in_bits(util.MODE_ALPHA_NUM, version)
+        # 11 bits per pair of characters, 6 for the odd one
+        return bits // 11 * 2 + (bits % 11 >= 6)
+    raise ValueError('unknown mode: ' + str(mode))
+
+
+def frame_total(size, chuck_length, mode='b64', frame_header=False, fec_ratio=0, fec_group=64):
+    """
+    The number of frames of a file, with the settings of `QRCodec`.
+
+    :param size: size of the file, after compression
+    :param chuck_length: characters per frame, bytes in 'bin' mode
+    :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+    :param frame_header: see `QRCodec.frame_header`
+    :param fec_ratio: see `QRCodec.fec_ratio`
+    :param fec_group: see `QRCodec.fec_group`
+    :return: number of frames
+    """
+    if not frame_header:
+        return QRContainer.frame_count(size, chuck_length, mode)
+    length = QRContainer.chunk_length(chuck_length, mode, fec=bool(fec_ratio))
+    total = QRContainer.frame_count(size, length, mode)
+    frames = total + 1  # the trailer
+    if fec_ratio:
+        n_groups = QRContainer.group_count(total, fec_group)
+        frames += sum(math.ceil(len(range(g, total, n_groups)) * fec_ratio) for g in range(n_groups)) + 1
+    return frames
+
+
+def _frame_modules(version, border=2):
+    return (17 + 4 * version + 2 * border) ** 2
+
+
+def frame_work(version, border=2):
+    """
+    The render cost of a frame, in modules rendered, its dispatch included.
+    """
+    return _frame_modules(version, border) + FRAME_OVERHEAD
+
+
+def plan(size, mode='b64', max_frames=None, max_bytes=None, error_correction=None,
+         frame_header=False, fec_ratio=0, fec_group=64):
+    """
+    Plan the encoding of a file of `size` bytes.
+    The plan with the least total render cost, the frames times the cost of one frame,
+    among the plans that meet `max_frames` and/or `max_bytes` when they are given.
+    The most robust error correction level goes first among equal costs.
+    `ValueError` is raised when no plan meets the targets.
+
+    :param size: size of the file, after compression
+    :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+    :param max_frames: the most frames wanted, None for no target
+    :param max_bytes: the largest GIF wanted in bytes, estimated, None for no target
+    :param error_correction: a qrcode.constants.ERROR_CORRECT_* level to stick to, None to choose it too
+    :param frame_header: see `QRCodec.frame_header`
+    :param fec_ratio: see `QRCodec.fec_ratio`
+    :param fec_group: see `QRCodec.fec_group`
+    :return: Plan
+    """
+    levels = EC_LEVELS if error_correction is None else [error_correction]
+    best, best_key = None, None
+    for version in range(1, 41):
+        modules = _frame_modules(version)
+        for robustness, level in enumerate(levels):
+            chuck_length = capacity(version, level, mode)
+            try:
+                frames = frame_total(size, chuck_length, mode, frame_header, fec_ratio, fec_group)
+            except ValueError:  # the frames are too small for the header
+                continue
+            gif_size = int(GIF_FILE_BYTES + frames * (GIF_FRAME_BYTES + GIF_BYTES_PER_MODULE * modules))
+            if max_frames is not None and frames > max_frames or max_bytes is not None and gif_size > max_bytes:
+                continue
+            key = (frames * frame_work(version), -robustness)
+            if best_key is None or key < best_key:
+                best, best_key = Plan(version, level, chuck_length, frames, gif_size), key
+    if best is None:
+        raise ValueError('No QR version fits {} bytes in {} frames, {} bytes.'.format(size, max_frames, max_bytes))
+    return best
@@ -0,0 +1,188 @@
+"""
+A reusable worker pool, to share between the calls of `QRCodec` and `CuteRMP`.
+
+Starting `cpu_count()` processes and importing PIL and qrcode in each of them
+costs more than encoding a small file. A `WorkerPool` starts its workers once,
+warms them up (the imports done, the QR layouts built, see `QRFrame.get_builder`),
+and serves any number of jobs until it is closed:
+
+    with WorkerPool.WorkerPool(templates=[(40, qrcode.constants.ERROR_CORRECT_L)]) as pool:
+        q = main.QRCodec()
+        q.pool = pool
+        q.encode(...)
+        CuteRMP.produce(..., pool=pool)
+
+`runner(n_tasks, work)` tells where a job should go: a job of a few tasks, or
+of little work when its work is known, runs inline while the workers are not
+started, the pool would take longer to start than the job to run.
+"""
+import importlib
+import multiprocessing
+import multiprocessing.pool
+
+
+__all__ = ['WorkerPool', 'INLINE']
+
+
+WARM_MODULES = ('PIL.Image', 'qrcode', 'GIFSurface', 'GIFencoder', 'QRFrame')
+
+# about 0.1 s of rendering on one core, 64 frames of version 5, see QRPlanner.frame_work
+INLINE_WORK = 130000
+
+
+def _warm(modules, templates):
+    """
+    The initializer of the workers: import the modules and build the QR layouts of the templates.
+    """
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError:  # the job that needs it will tell
+            pass
+    if templates:
+        import QRFrame
+        for template in templates:
+            QRFrame.get_builder(*template)
+
+
+class _InlineResult(object):
+    """
+    The result of a task run inline, with the interface of `multiprocessing.pool.AsyncResult`.
+    """
+    def __init__(self, func, args, kwds):
+        try:
+            self._value, self._success = func(*args, **kwds), True
+        except Exception as e:
+            self._value, self._success = e, False
+
+    def ready(self):
+        return True
+
+    def successful(self):
+        return self._success
+
+    def wait(self, timeout=None):
+        return
+
+    def get(self, timeout=None):
+        if self._success:
+            return self._value
+        raise self._value
+
+
+class _Inline(object):
+    """
+    Runs the tasks in the calling thread, as they are submitted.
+    """
+    @staticmethod
+    def apply_async(func, args=(), kwds=None):
+        return _InlineResult(func, args, kwds or {})
+
+    @staticmethod
+    def imap(func, iterable, chunksize=1):
+        return map(func, iterable)
+
+
+INLINE = _Inline()
+
+
+class WorkerPool(object):
+    """
+    A multiprocessing.Pool or ThreadPool started once and reused, usable as a context manager.
+    It has the `apply_async`, `imap`, `close` and `join` of the pools it wraps.
+    """
+    def __init__(self, processes=None, pool_type='process', prestart=True, inline_below=8,
+                 inline_work=INLINE_WORK, modules=WARM_MODULES, templates=()):
+        """
+        :param processes: number of workers, defaults to `cpu_count()`
+        :param pool_type: 'process' for a multiprocessing pool, 'thread' for a thread pool
+        :param prestart: start the workers now, they warm up while the caller prepares its first job.
+            Otherwise they start with the first job sent to the pool.
+        :param inline_below: jobs of fewer tasks run inline while the workers are not started
+        :param inline_work: jobs of less work, when it is known, run inline while the workers are not started
+        :param modules: modules each worker imports as it starts
+        :param templates: (version, error_correction[, border, mask_pattern]) of the QR layouts each worker
+            builds as it starts, see `QRFrame.get_builder`
+        """
+        if pool_type not in ('process', 'thread'):
+            raise ValueError('unknown pool_type: ' + str(pool_type))
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pool_type = pool_type
+        self.inline_below = inline_below
+        self.inline_work = inline_work
+        self.modules = tuple(modules)
+        self.templates = [tuple(template) for template in templates]
+        self._pool = None
+        self._closed = False
+        if prestart:
+            self.start()
+
+    @property
+    def started(self):
+        return self._pool is not None
+
+    def start(self):
+        """
+        Start the workers, if they are not already.
+        """
+        if self._closed:
+            raise ValueError('Pool not running')
+        if self._pool is None:
+            if self.pool_type == 'thread':
+                # the threads share the imports and the layouts of this process
+                _warm(self.modules, self.templates)
+                self._pool = multiprocessing.pool.ThreadPool(processes=self.processes)
+            else:
+                self._pool = multiprocessing.Pool(processes=self.processes, initializer=_warm,
+                                                  initargs=(self.modules, self.templates))
+        return self
+
+    def runner(self, n_tasks=None, work=None):
+        """
+        Where to send a job: the pool, or `INLINE` when the job is too small to be worth starting the workers.
+        The work of the job decides when it is given, a few large tasks are worth the pool.
+        A started pool takes any job.
+
+        :param n_tasks: number of tasks of the job, None if not known
+        :param work: estimated work of the job, in QR modules rendered, None if not known
+        :return: an object with `apply_async` and `imap`
+        """
+        if self._pool is None:
+            if n_tasks is not None and n_tasks < 2:  # nothing to run in parallel
+                return INLINE
+            if work is not None:
+                if work < self.inline_work:
+                    return INLINE
+            elif n_tasks is not None and n_tasks < self.inline_below:
+                return INLINE
+        return self.start()
+
+    def apply_async(self, func, args=(), kwds=None):
+        return self.start()._pool.apply_async(func, args, kwds or {})
+
+    def imap(self, func, iterable, chunksize=1):
+        return self.start()._pool.imap(func, iterable, chunksize)
+
+    def close(self):
+        self._closed = True
+        if self._pool is not None:
+            self._pool.close()
+
+    def terminate(self):
+        self._closed = True
+        if self._pool is not None:
+            self._pool.terminate()
+
+    def join(self):
+        if self._pool is not None:
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+        self.join()
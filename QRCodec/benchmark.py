@@ -0,0 +1,508 @@
+"""
+Micro benchmarks for the GIF assembler.
+
+Run from this directory: `python benchmark.py`.
+The frames are taken from the sample GIFs in `../benchmarks/`, the first
+(background) frame of each file is skipped.
+"""
+from PIL import Image
+from PIL import ImageSequence
+import glob
+import os
+import tempfile
+import random
+import time
+import tracemalloc
+import base64
+import qrcode
+import Compression
+import FrameCache
+import GIFencoder
+import GIFSurface
+import QRFrame
+import main
+
+
+BENCHMARK_DIR = '../benchmarks'
+
+
+class LegacyDataBlock(object):
+    """
+    The string based bit writer shipped before the integer LZW engine,
+    kept here as the baseline of the benchmarks.
+    """
+
+    def __init__(self):
+        self._bitstream = bytearray()
+        self._nbits = 0
+
+    def encode_bits(self, num, size):
+        string = bin(num)[2:].zfill(size)
+        for digit in reversed(string):
+            if len(self._bitstream) * 8 == self._nbits:
+                self._bitstream.append(0)
+            if digit == '1':
+                self._bitstream[-1] |= 1 << (self._nbits % 8)
+            self._nbits += 1
+
+    def dump_bytes(self):
+        bytestream = bytearray()
+        while len(self._bitstream) > 255:
+            bytestream.append(255)
+            bytestream.extend(self._bitstream[:255])
+            self._bitstream = self._bitstream[255:]
+        if len(self._bitstream) > 0:
+            bytestream.append(len(self._bitstream))
+            bytestream.extend(self._bitstream)
+
+        self._nbits = 0
+        self._bitstream = bytearray()
+        return bytestream
+
+
+legacy_stream = LegacyDataBlock()
+
+
+def legacy_lzw_compress(input_data, mcl):
+    """
+    The tuple keyed LZW compressor shipped before the integer LZW engine.
+    """
+    clear_code = (1 << mcl)
+    end_code = clear_code + 1
+    max_codes = 4096
+
+    code_length = mcl + 1
+    next_code = end_code + 1
+    code_table = {(i,): i for i in range(1 << mcl)}
+    legacy_stream.encode_bits(clear_code, code_length)
+
+    pattern = tuple()
+    for c in input_data:
+        pattern += (c,)
+        if pattern not in code_table:
+            code_table[pattern] = next_code
+            legacy_stream.encode_bits(code_table[pattern[:-1]], code_length)
+            pattern = (c,)
+
+            next_code += 1
+            if next_code == 2**code_length + 1:
+                code_length += 1
+
+            if next_code == max_codes:
+                next_code = end_code + 1
+                legacy_stream.encode_bits(clear_code, code_length)
+                code_length = mcl + 1
+                code_table = {(i,): i for i in range(1 << mcl)}
+
+    legacy_stream.encode_bits(code_table[pattern], code_length)
+    legacy_stream.encode_bits(end_code, code_length)
+    return bytearray([mcl]) + legacy_stream.dump_bytes() + bytearray([0])
+
+
+def load_frames(gif_path):
+    """
+    Read the color indices of every QR frame of a GIF written by `QRCodec`.
+    The palette is black and white so the index is simply the luminance bit.
+    """
+    frames = []
+    img = Image.open(gif_path)
+    for i, frame in enumerate(ImageSequence.Iterator(img)):
+        if i == 0:
+            continue  # skip the background frame
+        frames.append([p // 255 for p in frame.convert('L').getdata()])
+    return frames
+
+
+def timeit(func, frames, mcl=2):
+    t = time.time()
+    results = [func(pixels, mcl=mcl) for pixels in frames]
+    return time.time() - t, results
+
+
+def bench_lzw():
+    """
+    Compare frames/sec of the legacy and the current LZW compressor,
+    and make sure the two produce identical bytes.
+    """
+    print('LZW compression, frames/sec')
+    for gif_path in sorted(glob.glob(os.path.join(BENCHMARK_DIR, '*.gif'))):
+        frames = load_frames(gif_path)
+        t_old, out_old = timeit(legacy_lzw_compress, frames)
+        t_new, out_new = timeit(GIFencoder.lzw_compress, frames)
+        assert out_old == out_new, 'LZW output differs on ' + gif_path
+        print('{:<20} {:>5} frames  before {:>8.1f}  after {:>8.1f}  speedup {:.2f}x'.format(
+            os.path.basename(gif_path), len(frames),
+            len(frames) / t_old, len(frames) / t_new, t_old / t_new))
+    return
+
+
+def bench_bits(n_codes=200000):
+    """
+    Compare codes/sec of the legacy and the current bit writer on random
+    codes of 3 to 12 bits, the code lengths the LZW compressor emits.
+    """
+    rng = random.Random(0)
+    codes = []
+    for _ in range(n_codes):
+        size = rng.randint(3, 12)
+        codes.append((rng.getrandbits(size), size))
+
+    print('Bit packing, codes/sec')
+    outputs = []
+    for name, block in (('before', LegacyDataBlock()), ('after', GIFencoder.DataBlock())):
+        t = time.time()
+        for num, size in codes:
+            block.encode_bits(num, size)
+        outputs.append(block.dump_bytes())
+        t = time.time() - t
+        print('{:<8} {:>12.0f}'.format(name, n_codes / t))
+    assert outputs[0] == outputs[1], 'bit writers disagree'
+    return
+
+
+def bench_render(n_frames=50):
+    """
+    Compare frames/sec of the list comprehension and the NumPy renderer
+    on version 40 matrices, LZW compression included.
+    """
+    rng = random.Random(0)
+    qr = qrcode.QRCode(version=40, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=1, border=2)
+    mats = []
+    for _ in range(n_frames):
+        qr.clear()
+        qr.add_data(bytes(rng.getrandbits(8) for _ in range(2953)))
+        mats.append(qr.get_matrix())
+    size = len(mats[0])
+
+    print('Render, version 40 frames/sec')
+    outputs = []
+    for name, vectorize in (('loop', False), ('numpy', True)):
+        render = GIFSurface.Render({True: 0, False: 1}, 2, vectorize=vectorize)
+        t = time.time()
+        outputs.append([render(size, size, mat) for mat in mats])
+        t = time.time() - t
+        print('{:<8} {:>8.1f}'.format(name, n_frames / t))
+    assert outputs[0] == outputs[1], 'renderers disagree'
+    return
+
+
+def bench_frames(n_frames=20):
+    """
+    Compare frames/sec of `qrcode` and the fixed-layout frame builder
+    on version 40 matrices, and make sure the two produce identical matrices.
+    """
+    rng = random.Random(0)
+    chunks = [bytes(rng.getrandbits(8) for _ in range(2953)) for _ in range(n_frames)]
+    qr = qrcode.QRCode(version=40, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=1, border=2)
+
+    print('QR matrix, version 40 frames/sec')
+    t = time.time()
+    mats = []
+    for s in chunks:
+        qr.clear()
+        qr.add_data(s)
+        mats.append(qr.get_matrix())
+    t = time.time() - t
+    print('{:<8} {:>8.1f}'.format('qrcode', n_frames / t))
+
+    for name, vectorize in (('fixed', False), ('numpy', True)):
+        builder = QRFrame.QRFrameBuilder(40, qrcode.constants.ERROR_CORRECT_L, border=2, vectorize=vectorize)
+        t = time.time()
+        outputs = [builder.get_matrix(s) for s in chunks]
+        t = time.time() - t
+        print('{:<8} {:>8.1f}'.format(name, n_frames / t))
+        assert [[list(map(bool, row)) for row in mat] for mat in outputs] == mats, 'frame builders disagree'
+    return
+
+
+def bench_mask(input_path='../test_images/ECE564.png'):
+    """
+    Compare the encode time of `QRCodec` with the mask searched on every frame,
+    picked once from the first chunk, and pinned, on the version 40 configurations.
+    """
+    print('QRCodec.encode, version 40 seconds')
+    for mode, chuck_length in (('b64', 2953), ('b32', 4295)):
+        for mask_pattern in (None, 'sample', 0):
+            q = main.QRCodec()
+            q.qr_version = 40
+            q.chuck_length = chuck_length
+            q.mask_pattern = mask_pattern
+            with tempfile.TemporaryDirectory() as temp_dir:
+                t = time.time()
+                q.encode(input_path, os.path.join(temp_dir, 'out.gif'), mode=mode)
+                t = time.time() - t
+            print('{}_v40_{:<8} mask {:<8} {:>8.2f}'.format(mode, chuck_length, str(mask_pattern), t))
+    return
+
+
+def bench_decode():
+    """
+    Compare the decode time of the pyzbar path and the direct module grid reader
+    on the sample GIFs, and make sure the two recover the same file.
+    """
+    print('QRCodec.decode, seconds')
+    q = main.QRCodec()
+    for gif_path in sorted(glob.glob(os.path.join(BENCHMARK_DIR, '*.gif'))):
+        mode = os.path.basename(gif_path)[:3]
+        outputs = []
+        times = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for decode in (q.decode, q.decode_direct):
+                output_path = os.path.join(temp_dir, 'out.bin')
+                t = time.time()
+                decode(gif_path, output_path, mode=mode)
+                times.append(time.time() - t)
+                with open(output_path, 'rb') as f:
+                    outputs.append(f.read())
+        assert outputs[0] == outputs[1], 'decoders disagree on ' + gif_path
+        print('{:<20} pyzbar {:>8.2f}  direct {:>8.2f}  speedup {:.2f}x'.format(
+            os.path.basename(gif_path), times[0], times[1], times[0] / times[1]))
+    return
+
+
+def bench_fec(input_path='../test_images/ECE564.png', loss_rates=(0.001, 0.01, 0.05), trials=50):
+    """
+    Weigh the cost of the parity frames against the retries they save.
+    A frame lost on the way fails the whole transfer without parity frames, and
+    the file has to be encoded and sent again. For each loss rate the frames are
+    dropped at random, and the expected encode time until a transfer succeeds is
+    the encode time divided by the success rate.
+    """
+    rng = random.Random(0)
+    print('Parity frames, version 40 b64, expected encode seconds until success')
+    for fec_ratio in (0, 0.05, 0.1, 0.25):
+        q = main.QRCodec()
+        q.qr_version = 40
+        q.chuck_length = 2953
+        q.frame_header = True
+        q.fec_ratio = fec_ratio
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, 'out.bin')
+            t = time.time()
+            q.encode(input_path, os.path.join(temp_dir, 'out.gif'))
+            t = time.time() - t
+
+            with open(input_path, 'rb') as f:
+                original = f.read()
+                f.seek(0)
+                frames = [p.encode() for p in q.iter_payloads(f)]
+            results = []
+            for loss_rate in loss_rates:
+                success = 0
+                for _ in range(trials):
+                    received = [frame for frame in frames if rng.random() >= loss_rate]
+                    try:
+                        q.write_decoded(received, output_path)
+                    except ValueError:
+                        continue
+                    with open(output_path, 'rb') as f:
+                        success += f.read() == original
+                rate = success / trials
+                results.append('{:>8.2f}'.format(t / rate) if rate else '     inf')
+        print('ratio {:<5} {:>4} frames  encode {:>6.2f}  loss {}'.format(
+            fec_ratio, len(frames), t, '  '.join('{} {}'.format(p, r) for p, r in zip(loss_rates, results))))
+    return
+
+
+def bench_compression(input_paths=('../test_images/ECE564.png', '../test_images/128-0.jpg',
+                                   '../test_images/bufu.gif', 'main.py', 'GIFencoder.py')):
+    """
+    Frames and encode time saved by the compression stage, per file type.
+    Already compressed files (png, jpg, gif) should be sent as they are by 'auto',
+    text files should shrink to a fraction of their frames.
+    """
+    print('Compression, version 40 b64, frames and encode seconds')
+    for input_path in input_paths:
+        results = []
+        for compression in (None, 'auto'):
+            q = main.QRCodec()
+            q.qr_version = 40
+            q.chuck_length = 2953
+            q.compression = compression
+            with q.open_input(input_path) as f:
+                n_frames = sum(1 for _ in q.iter_chunks(f))
+            with tempfile.TemporaryDirectory() as temp_dir:
+                t = time.time()
+                q.encode(input_path, os.path.join(temp_dir, 'out.gif'))
+                results.append((n_frames, time.time() - t))
+        with open(input_path, 'rb') as f:
+            method = Compression.choose_method(f.read(Compression.SAMPLE_SIZE))
+        (raw_frames, raw_time), (frames, t) = results
+        print('{:<12} {:>8} bytes  {:<5} frames {:>4} -> {:>4}  saved {:>6.2f}s of {:>6.2f}s'.format(
+            os.path.splitext(input_path)[1], os.path.getsize(input_path), str(method),
+            raw_frames, frames, raw_time - t, raw_time))
+    return
+
+
+def bench_pool(sizes=(300, 3000, 30000), n_files=5):
+    """
+    Encode several small files with a new pool per call, the old way, with the adaptive
+    pool per call that runs the small jobs inline, and with one shared WorkerPool.
+    """
+    print('Worker pools, {} files of each size, seconds'.format(n_files))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            paths = []
+            for i in range(n_files):
+                paths.append(os.path.join(temp_dir, '{}_{}.bin'.format(size, i)))
+                with open(paths[-1], 'wb') as f:
+                    f.write(os.urandom(size))
+            q = main.QRCodec()
+            results = []
+
+            t = time.time()
+            for path in paths:
+                with q.make_pool() as pool:
+                    q.pool = pool
+                    q.encode(path, path + '.gif')
+            results.append(time.time() - t)
+
+            q.pool = None
+            t = time.time()
+            for path in paths:
+                q.encode(path, path + '.gif')
+            results.append(time.time() - t)
+
+            t = time.time()
+            with q.make_pool() as pool:
+                q.pool = pool
+                for path in paths:
+                    q.encode(path, path + '.gif')
+            results.append(time.time() - t)
+            print('{:>6} bytes  pool per call {:>6.2f}  adaptive {:>6.2f}  shared {:>6.2f}'.format(size, *results))
+    return
+
+
+def bench_batch(input_path='../test_images/ECE564.png', batches=(1, 4, 8, 32)):
+    """
+    Encode time by the number of frames per task, see `QRCodec.frame_batch`.
+    The tasks carry a FrameSpec and their chunks, the workers keep the generator and the renderer.
+    """
+    print('Frames per task, version 6 b64, {}'.format(input_path))
+    for pool_type in ('process', 'thread'):
+        for frame_batch in batches:
+            q = main.QRCodec()
+            q.pool_type = pool_type
+            q.frame_batch = frame_batch
+            with tempfile.TemporaryDirectory() as temp_dir, q.make_pool() as pool:
+                q.pool = pool
+                t = time.time()
+                q.encode(input_path, os.path.join(temp_dir, 'out.gif'))
+                print('{:<8} batch {:>3} {:>8.2f}'.format(pool_type, frame_batch, time.time() - t))
+    return
+
+
+def bench_cache(size=1 << 20, island=4096, spacing=65536):
+    """
+    Encode a sparse file, zeros with random islands, without and with the frame cache,
+    then again with the cache directory filled by the previous run.
+    """
+    data = bytearray(size)
+    for i in range(0, size, spacing):
+        data[i:i + island] = os.urandom(island)
+    print('Frame cache, version 40 b64, {} bytes sparse file'.format(size))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, 'sparse.bin')
+        with open(input_path, 'wb') as f:
+            f.write(data)
+        q = main.QRCodec()
+        q.qr_version = 40
+        q.chuck_length = 2953
+        for label, cache in (('no cache', None),
+                             ('cache', FrameCache.FrameCache(path=os.path.join(temp_dir, 'cache'))),
+                             ('cache dir', FrameCache.FrameCache(path=os.path.join(temp_dir, 'cache')))):
+            q.frame_cache = cache
+            t = time.time()
+            q.encode(input_path, os.path.join(temp_dir, 'out.gif'))
+            t = time.time() - t
+            counts = '' if cache is None else '  {} hits ({} from disk)  {} misses'.format(
+                cache.hits, cache.disk_hits, cache.misses)
+            print('{:<10} {:>8.2f}{}'.format(label, t, counts))
+    return
+
+
+def bench_incremental(size=1 << 20, edit=4096):
+    """
+    Encode a file, overwrite its last `edit` bytes and encode the new revision in full, then incrementally
+    with the manifest of the previous GIF, then incrementally by decoding the previous GIF.
+    """
+    data = bytearray(os.urandom(size))
+    print('Incremental encode, version 40 b64, {} bytes file, last {} bytes changed'.format(size, edit))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, 'doc.bin')
+        old_path = os.path.join(temp_dir, 'old.gif')
+        with open(input_path, 'wb') as f:
+            f.write(data)
+        q = main.QRCodec()
+        q.qr_version = 40
+        q.chuck_length = 2953
+        q.encode_incremental(input_path, old_path)
+        data[-edit:] = os.urandom(edit)
+        with open(input_path, 'wb') as f:
+            f.write(data)
+
+        t = time.time()
+        q.encode_stream(input_path, os.path.join(temp_dir, 'full.gif'))
+        print('{:<10} {:>8.2f}'.format('full', time.time() - t))
+        t = time.time()
+        stats = q.encode_incremental(input_path, os.path.join(temp_dir, 'manifest.gif'), old_path)
+        print('{:<10} {:>8.2f}  {} of {} frames reused'.format('manifest', time.time() - t, stats.reused, stats.frames))
+        os.remove(FrameCache.manifest_path(old_path))
+        t = time.time()
+        stats = q.encode_incremental(input_path, os.path.join(temp_dir, 'decoded.gif'), old_path)
+        print('{:<10} {:>8.2f}  {} of {} frames reused'.format('decoded', time.time() - t, stats.reused, stats.frames))
+    return
+
+
+def bench_zero_copy(size=4 << 20):
+    """
+    Encode a file with the chunks read and sent by this process, and with ChunkRange tasks the workers read
+    from their own memory map. Report the time and the peak of the memory allocated in this process, next to
+    the peak of only reading, encoding and slicing the whole file the way `encode` used to.
+    """
+    print('Zero copy input, version 40 b64, {} bytes file, peak MB in this process'.format(size))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, 'big.bin')
+        with open(input_path, 'wb') as f:
+            f.write(os.urandom(size))
+
+        tracemalloc.start()
+        with open(input_path, 'rb') as f:
+            encoded_string = base64.b64encode(f.read()).decode()
+        string_list = [encoded_string[i:i + 2953] for i in range(0, len(encoded_string), 2953)]
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del encoded_string, string_list
+        print('{:<14} {:>8} {:>8.1f}'.format('whole file', '', peak / 1e6))
+
+        q = main.QRCodec()
+        q.qr_version = 40
+        q.chuck_length = 2953
+        with q.make_pool() as pool:
+            q.pool = pool
+            for zero_copy in (False, True):
+                q.zero_copy = zero_copy
+                tracemalloc.start()
+                t = time.time()
+                q.encode(input_path, os.path.join(temp_dir, 'out.gif'))
+                t = time.time() - t
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print('{:<14} {:>8.2f} {:>8.1f}'.format('ranges' if zero_copy else 'chunks', t, peak / 1e6))
+    return
+
+
+if __name__ == '__main__':
+    bench_zero_copy()
+    bench_incremental()
+    bench_cache()
+    bench_batch()
+    bench_pool()
+    bench_compression()
+    bench_fec()
+    bench_decode()
+    bench_mask()
+    bench_frames()
+    bench_bits()
+    bench_render()
+    bench_lzw()
@@ -3,22 +3,242 @@ from PIL import ImageSequence
 from pyzbar.pyzbar import decode as QRdecode
 import qrcode
 import multiprocessing
+import os
 import base64
+import glob
+import collections
+import contextlib
+import hashlib
+import itertools
+import math
+import mmap
+import zlib
+import Compression
+import FrameCache
 import GIFSurface
 import GIFencoder
+import GIFdecoder
+import QRContainer
+import QRFrame
+import QRPlanner
+import WorkerPool
 import time
 
 
+# the report of an encoded file, `seconds` from the first frame dispatched to the GIF closed,
+# `reused` the frames of an incremental encode not rendered, copied from the previous GIF or from an identical chunk
+EncodeStats = collections.namedtuple('EncodeStats', ['input', 'output', 'size', 'frames', 'seconds', 'reused'],
+                                     defaults=(0, ))
+
+# a GIF being written by `iter_encode`: the surface, on a temporary file renamed to `output` once closed,
+# the (key, offset, length) of its frames when a manifest is written, and the GIFFrames of the previous revision
+_OutputGIF = collections.namedtuple('_OutputGIF', ['surface', 'control', 'output', 'manifest', 'previous'])
+
+# what a worker needs to render the frames of a file, sent with every task instead of the generator and
+# renderer objects. `cmap` holds the items of the colormap.
+FrameSpec = collections.namedtuple('FrameSpec', ['version', 'error_correction', 'border', 'mask_pattern',
+                                                 'fixed_layout', 'width', 'height', 'cmap', 'mcl'])
+
+# a batch of chunks the workers read from the input file themselves, instead of receiving them: the chunks
+# `start` to `stop` of the file `path`, whose data is the `size` bytes from `offset`, cut by `chunk_size`.
+# `revision` is the (st_ino, st_mtime_ns, st_size) of the file when the encoding started.
+ChunkRange = collections.namedtuple('ChunkRange', ['path', 'offset', 'size', 'revision', 'mode', 'chunk_size',
+                                                   'start', 'stop'])
+
+# the renderers of this process, by (cmap, mcl)
+_renders = {}
+
+
+def file_revision(f):
+    """
+    What tells a revision of an opened file from the next one, see ChunkRange.
+    """
+    st = os.fstat(f.fileno())
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def read_chunks(chunk_range):
+    """
+    Read the chunks of a ChunkRange out of a memory map of the file, the same payloads
+    `QRCodec.iter_payloads` yields. Only the bytes under the chunks are encoded.
+    The file is mapped for the task only, `ValueError` is raised if it is not the revision of the range anymore.
+
+    :param chunk_range: ChunkRange
+    :return: list of the payloads
+    """
+    path, offset, size, revision, mode, chunk_size, start, stop = chunk_range
+    # the encoded characters of the chunks, widened to whole groups of characters and bytes
+    chars, nbytes = QRContainer.GROUPS[mode]
+    begin = start * chunk_size
+    end = min(stop * chunk_size, (size + nbytes - 1) // nbytes * chars)
+    first_group = begin // chars
+    with open(path, 'rb') as f:
+        if file_revision(f) != revision:
+            raise ValueError(path + ' changed while it was encoded.')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            raw = data[offset + first_group * nbytes:offset + min((end + chars - 1) // chars * nbytes, size)]
+    if mode == 'b64':
+        encoded = base64.b64encode(raw).decode()
+    elif mode == 'b32':
+        encoded = base64.b32encode(raw).decode().replace('=', '$')
+    else:
+        encoded = raw
+    encoded = encoded[begin - first_group * chars:end - first_group * chars]
+    return [QRCodec.payload(encoded[i:i + chunk_size], mode) for i in range(0, len(encoded), chunk_size)]
+
+
+def render_frames(spec, chunks):
+    """
+    Render a batch of frames. Runs in the workers, the frame builder and the renderer are built
+    once per process from the spec and reused by the following tasks.
+
+    :param spec: FrameSpec
+    :param chunks: list of the chunks to convert to QR code, or a ChunkRange to read them from
+    :return: list of the rendered frames, graphics control blocks excluded
+    """
+    if isinstance(chunks, ChunkRange):
+        chunks = read_chunks(chunks)
+    key = (spec.cmap, spec.mcl)
+    if key not in _renders:
+        _renders[key] = GIFSurface.Render(dict(spec.cmap), spec.mcl)
+    render = _renders[key]
+    if spec.fixed_layout:
+        builder = QRFrame.get_builder(spec.version, spec.error_correction, spec.border, spec.mask_pattern)
+        return [QRCodec.gen_fixed_frame(builder, s, spec.width, spec.height, render) for s in chunks]
+    # the qr generator object is stateful, every batch gets its own
+    qr = qrcode.QRCode(version=spec.version, error_correction=spec.error_correction, box_size=1,
+                       border=spec.border, mask_pattern=spec.mask_pattern)
+    return [QRCodec.gen_qr_render_frame(qr, s, spec.width, spec.height, render) for s in chunks]
+
+
 class QRCodec:
 
     qr_version = 5  # commonly 1-10, check QR code docs, full 1-40
     err_crt = qrcode.constants.ERROR_CORRECT_L
 
     chuck_length = 134  # 134 at most for version 6, 2953 at most for version 40 base64
+    # in 'bin' mode chuck_length counts raw bytes, 134 for version 6, 2953 for version 40
+    # `plan` sets qr_version, err_crt and chuck_length together for a file
 
     GIF_version = 'GIF89a'
     GIF_delay = 100  # 200ms or 5 frames per second
 
+    # 'process' dispatches frames to a multiprocessing pool, 'thread' to a thread pool.
+    # threads avoid process spawn and pickling, and scale when the frame work releases the GIL.
+    pool_type = 'process'
+
+    stream_window = 4  # tasks in flight per worker in encode_stream, bounds the memory used
+
+    # send the workers ChunkRange tasks: each one maps the input and encodes only the bytes of its own chunks,
+    # the chunks are neither read nor pickled here. it applies to the files sent as they are, without
+    # frame_header, frame_cache, frame_manifest nor previous GIF, the others send the chunks.
+    zero_copy = True
+
+    # frames rendered per task sent to the pool. a task carries the FrameSpec and the chunks in,
+    # and the compressed frames out, so the pickling and round trip costs are shared by the batch.
+    frame_batch = 8
+
+    # build the frames on a precomputed QR layout instead of letting qrcode rebuild it every frame.
+    # the frames are identical either way.
+    fixed_layout = True
+
+    # None lets every frame pick its best mask out of 8 like qrcode does, which costs about 8x the matrix work.
+    # 0-7 pins that mask for every frame, 'sample' picks the best mask of the first chunk and reuses it.
+    # pyzbar reads any mask, so pinning only changes how the frames look.
+    mask_pattern = None
+
+    # put a header with file id, frame index, total frames and CRC32 in front of every chunk,
+    # and a trailer frame with the size and SHA-256 of the file, see QRContainer.
+    # the decoders tell framed GIFs apart by themselves.
+    frame_header = False
+
+    # with frame_header, add ceil(k * fec_ratio) Reed-Solomon parity frames to every group of k data frames,
+    # any k frames of a group rebuild it. 0 adds none. fec_group caps k, up to 128.
+    fec_ratio = 0
+    fec_group = 64
+
+    # compress the file before chunking it: None, 'zlib', 'bz2', 'lzma', 'zstd' (needs zstandard),
+    # or 'auto' to pick the best one on a sample. the file is sent as it is when compressing does not shrink it.
+    # the compressed stream carries its own header, the decoders decompress by themselves.
+    compression = None
+
+    # a FrameCache.FrameCache of the rendered frames: identical chunks are rendered once, within a file,
+    # across the files and, with a cache directory, across the runs. None renders every frame.
+    frame_cache = None
+
+    # write a sidecar manifest, <gif>.frames.json, of the keys and offsets of the frames of the GIFs written
+    # by encode_stream and encode_batch, for `encode_incremental` to find them without decoding the GIF.
+    # encode_incremental always writes one.
+    frame_manifest = False
+
+    # a WorkerPool.WorkerPool shared by the calls, its workers are started once. None makes a pool per call,
+    # started only for the jobs that are worth it.
+    pool = None
+
+    def make_pool(self, prestart=True, templates=None):
+        """
+        Create a worker pool of `pool_type`, with all the cores. Close it when done, or use it as a context manager.
+
+        :param prestart: start the workers now rather than with the first job worth it
+        :param templates: the QR layouts the workers build as they start, see WorkerPool.WorkerPool.
+            None for the layout of `qr_version`, `err_crt` and `mask_pattern`, none when the mask is sampled
+        :return: a WorkerPool.WorkerPool
+        """
+        if templates is None:
+            templates = [] if self.mask_pattern == 'sample' else [(self.qr_version, self.err_crt, 2, self.mask_pattern)]
+        return WorkerPool.WorkerPool(pool_type=self.pool_type, prestart=prestart, templates=templates)
+
+    @contextlib.contextmanager
+    def worker_pool(self):
+        """
+        The worker pool of a call: the shared `pool`, or a pool made for the call and closed after it.
+        """
+        if self.pool is not None:
+            yield self.pool
+            return
+        with self.make_pool(prestart=False) as pool:
+            yield pool
+
+    def open_input(self, input_file_path: str):
+        """
+        Open the file to encode, compressed according to `compression`.
+
+        :param input_file_path: input file path
+        :return: a binary file object to read the payload from, to be closed by the caller
+        """
+        f = open(input_file_path, 'rb')
+        if self.compression is not None:
+            with f:
+                compressed = Compression.compress_file(f, self.compression)
+            if compressed is not None:
+                return compressed
+            f = open(input_file_path, 'rb')
+        stored = Compression.store_file(f)  # a file that looks compressed gets a header saying it is not
+        if stored is None:
+            return f
+        f.close()
+        return stored
+
+    def plan(self, input_file_path: str, mode: str = 'b64', max_frames=None, max_bytes=None, error_correction=None):
+        """
+        Pick qr_version, err_crt and chuck_length for a file and set them, see QRPlanner.plan.
+        The frames are the cheapest to render in total among the ones that meet `max_frames`
+        and/or `max_bytes`. The chunks fill the frames exactly, so every frame gets the planned version.
+
+        :param input_file_path: input file path
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :param max_frames: the most frames wanted, None for no target
+        :param max_bytes: the largest GIF wanted in bytes, estimated, None for no target
+        :param error_correction: a qrcode.constants.ERROR_CORRECT_* level to stick to, None to choose it too
+        :return: QRPlanner.Plan
+        """
+        with self.open_input(input_file_path) as f:
+            size = f.seek(0, 2)
+        plan = QRPlanner.plan(size, mode, max_frames, max_bytes, error_correction,
+                              self.frame_header, self.fec_ratio, self.fec_group)
+        self.qr_version, self.err_crt, self.chuck_length = plan.version, plan.error_correction, plan.chuck_length
+        return plan
+
     @staticmethod
     def gen_qr_render_frame(qr_obj, s: str, width, height, render_obj):
         """
@@ -34,74 +254,457 @@ class QRCodec:
         """
         qr_obj.clear()
         qr_obj.add_data(s)
+        qr_obj.best_fit(start=qr_obj.version)
+        # qrcode's Reed-Solomon step fails on a block of zeros, see QRFrame.create_data
+        qr_obj.data_cache = QRFrame.create_data(qr_obj.version, qr_obj.error_correction, qr_obj.data_list)
+        qr_obj.make(fit=False)
         mat = qr_obj.get_matrix()
         return render_obj(width, height, mat)
 
+    @staticmethod
+    def gen_fixed_frame(builder, s: str, width, height, render_obj):
+        """
+        Same as `gen_qr_render_frame`, on a fixed-layout frame builder.
+
+        :param builder: the QRFrame.QRFrameBuilder object
+        :param s: the string to convert to QR code
+        :param width: render frame width
+        :param height: render frame height
+        :param render_obj: the renderer object
+        :return: frame rendered for the string
+        """
+        return render_obj(width, height, builder.get_matrix(s))
+
+    def fit_version(self, size, mode: str = 'b64'):
+        """
+        The QR version of the frames of a file: the smallest from `qr_version` that holds its longest payload
+        in the least compact QR mode of the payloads, byte mode, or alphanumeric for base32. qrcode only splits
+        a payload into other modes where it takes fewer bits, so every frame fits whatever its data.
+        The capacity comes from the tables, see QRPlanner.capacity, without making a QR code.
+
+        :param size: size of the file, after compression
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: QR version
+        """
+        if mode not in QRContainer.GROUPS:
+            raise ValueError('unknown mode: ' + str(mode))
+        if self.frame_header:
+            longest = QRContainer.longest_frame(size, self.chuck_length, mode, fec=bool(self.fec_ratio))
+        else:
+            chars, nbytes = QRContainer.GROUPS[mode]
+            longest = min(self.chuck_length, (size + nbytes - 1) // nbytes * chars)
+        for version in range(self.qr_version, 41):
+            if QRPlanner.capacity(version, self.err_crt, mode) >= longest:
+                return version
+        raise ValueError('Frames of {} characters do not fit a QR code, see chuck_length.'.format(longest))
+
+    def frame_spec(self, version, border, first_chunk, width, height, cmap, mcl):
+        """
+        Describe the frames of a file for `render_frames`.
+
+        :param version: QR version of the frames, see `fit_version`
+        :param border: width of the light border around the QR codes, in modules
+        :param first_chunk: the payload of the first frame, '' for none
+        :param width: render frame width
+        :param height: render frame height
+        :param cmap: the colormap of the renderer
+        :param mcl: the minimum code length of the renderer
+        :return: FrameSpec
+        """
+        mask_pattern = self.mask_pattern
+        if mask_pattern == 'sample':
+            mask_pattern = QRFrame.get_builder(version, self.err_crt, border).best_mask_pattern(first_chunk)
+        elif mask_pattern is not None and mask_pattern not in range(8):
+            raise ValueError('unknown mask_pattern: ' + str(mask_pattern))
+        return FrameSpec(version, self.err_crt, border, mask_pattern, self.fixed_layout,
+                         width, height, tuple(cmap.items()), mcl)
+
+    def render_async(self, runner, spec, chunks, pending=None, cache=None):
+        """
+        Send a batch of frames to render to `runner`, through `frame_cache` if set.
+
+        :param runner: the pool or the inline runner, see WorkerPool.runner
+        :param spec: the FrameSpec of the frames
+        :param chunks: list of the chunks to convert to QR code
+        :param pending: dict shared by the batches in flight, for the cache to render a repeated chunk once
+        :param cache: the cache to go through instead of `frame_cache`, such as the GIFFrames of a previous GIF
+        :return: an object whose `get()` returns the list of the rendered frames
+        """
+        if cache is None:
+            cache = self.frame_cache
+        if cache is None:
+            return runner.apply_async(render_frames, args=(spec, chunks, ))
+        return FrameCache.CachedBatch(cache, runner, render_frames, spec, chunks, pending)
+
+    def iter_batches(self, chunks):
+        """
+        Group the chunks by `frame_batch`.
+
+        :param chunks: iterable of the chunks
+        :return: generator of lists of chunks
+        """
+        chunks = iter(chunks)
+        return iter(lambda: list(itertools.islice(chunks, self.frame_batch)), [])
+
     def encode(self, input_file_path: str, output_gif_path: str, mode: str = 'b64'):
         """
         The practical encoder with optimized GIF assembler and multiprocessing acceleration.
+        The input is memory-mapped and every worker encodes only the bytes of its own chunks, see `zero_copy`,
+        at most `stream_window` tasks per worker are in flight and the frames are appended to the GIF as they
+        come, so the memory used is a multiple of the window whatever the size of the file.
 
         :param input_file_path: input file path
         :param output_gif_path: output gif file path
-        :param mode: b64 for base64 encode, b32 for base32 encode
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
         :return: None
         """
+        with self.worker_pool() as pool1:
+            for _ in self.iter_encode([(input_file_path, output_gif_path)], pool1, mode):
+                pass
+        return
 
-        # open the file to encode
-        with open(input_file_path, 'rb') as f:
+    @staticmethod
+    def payload(chunk, mode: str = 'b64'):
+        """
+        Wrap a chunk for the QR generator. In 'bin' mode the raw bytes go in a single byte mode
+        segment, skipping qrcode's scan for the optimal modes. Text chunks are returned as they are.
+
+        :param chunk: a chunk of the encoded string, or of the raw bytes in 'bin' mode
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: the chunk to pass to `add_data`
+        """
+        if mode == 'bin':
+            return qrcode.util.QRData(chunk, mode=qrcode.util.MODE_8BIT_BYTE, check_data=False)
+        return chunk
+
+    def iter_chunks(self, f, mode: str = 'b64', chunk_size=None):
+        """
+        Read an opened binary file block by block and yield its encoded string in chunks of `chuck_length`.
+        The blocks are aligned so that the encoding of one block never needs padding,
+        the chunks are therefore identical to slicing the encoding of the whole file.
+        In 'bin' mode the raw bytes are yielded.
+
+        :param f: file object opened in 'rb' mode
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :param chunk_size: length of the chunks, defaults to `chuck_length`
+        :return: generator of string chunks
+        """
+        if chunk_size is None:
+            chunk_size = self.chuck_length
+        # 3 bytes -> 4 base64 chars, 5 bytes -> 8 base32 chars
+        if mode == 'b64':
+            block_size = 3 * chunk_size
+        elif mode == 'b32':
+            block_size = 5 * chunk_size
+        elif mode == 'bin':
+            for block in iter(lambda: f.read(chunk_size), b''):
+                yield block
+            return
+        else:
+            raise ValueError('unknown mode: ' + str(mode))
+
+        rest = ''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
             if mode == 'b64':
-                encoded_string = base64.b64encode(f.read()).decode()
-            if mode == 'b32':
-                encoded_string = base64.b32encode(f.read()).decode()
-                encoded_string = encoded_string.replace('=', '$')  # alphanumeric does not support equal sign
-        f.close()
+                encoded_string = rest + base64.b64encode(block).decode()
+            else:
+                encoded_string = rest + base64.b32encode(block).decode().replace('=', '$')
+            end = len(encoded_string) - len(encoded_string) % chunk_size
+            for i in range(0, end, chunk_size):
+                yield encoded_string[i:i + chunk_size]
+            rest = encoded_string[end:]
+        if rest:
+            yield rest
 
-        # chunk the string into pieces of length = 120
-        chunks, chunk_size = len(encoded_string), self.chuck_length  # len(encoded_string) // 120
-        string_list = [encoded_string[i:i + chunk_size] for i in range(0, chunks, chunk_size)]
+    def iter_payloads(self, f, mode: str = 'b64'):
+        """
+        Read an opened binary file and yield the payloads of its frames, ready for the QR generator.
+        With `frame_header` the file is hashed first, the chunks are shortened to make room for
+        the headers and a trailer frame closes the sequence. With `fec_ratio` the parity frames
+        and a second copy of the trailer follow.
 
-        # init the QRCode generator
-        # current can only set box_size to 1 due to QR matrix's format
-        qr = qrcode.QRCode(version=self.qr_version, error_correction=self.err_crt, box_size=1, border=2)
-        qr.add_data(string_list[0])
-        qr.make(fit=True)
+        :param f: file object opened in 'rb' mode
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: generator of payloads
+        """
+        if not self.frame_header:
+            for chunk in self.iter_chunks(f, mode):
+                yield self.payload(chunk, mode)
+            return
 
-        # extract the first frame as a reference frame, to generate following frames with same dimensions
-        frames_template = qr.make_image().convert(mode='L', palette='ADAPTIVE', colors=2)
+        start = f.tell()
+        sha256 = hashlib.sha256()
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+        size = f.tell() - start
+        f.seek(start)
+        digest = sha256.digest()
+        file_id = zlib.crc32(digest)
 
-        # make the drawing canvas
-        (width, height) = (frames_template.width, frames_template.height)
-        surface = GIFSurface.GIFSurface(width, height, bg_color=0)
-        # other colors to choose from - 78, 205, 196,   161,35,6,   150, 200, 100,   161, 35, 6,   255, 255, 255
-        surface.set_palette([0, 0, 0, 255, 255, 255])
+        chunk_size = QRContainer.chunk_length(self.chuck_length, mode, fec=bool(self.fec_ratio))
+        total = QRContainer.frame_count(size, chunk_size, mode)
+        parity = None
+        if self.fec_ratio:
+            parity = QRContainer.ParityEncoder(total, self.fec_ratio, self.fec_group, size, file_id, mode)
+        for i, chunk in enumerate(self.iter_chunks(f, mode, chunk_size)):
+            if parity is not None:
+                parity.add(chunk)
+            yield self.payload(QRContainer.pack_frame(chunk, file_id, i, total, mode=mode), mode)
+        trailer = self.payload(QRContainer.pack_trailer(size, digest, file_id, total, mode), mode)
+        yield trailer
+        if parity is not None:
+            for frame in parity.frames():
+                yield self.payload(frame, mode)
+            yield trailer
 
-        # the colormap for QRCode. map True to white
-        cmap = {True: 0, False: 1}  # Black -> True -> (0, 0, 0)
-        mcl = 2  # related to LZW compression alg, 2-10
-        render = GIFSurface.Render(cmap, mcl)
-        delay = self.GIF_delay
-        trans_index = None
+    def encode_stream(self, input_file_path: str, output_gif_path: str, mode: str = 'b64'):
+        """
+        The streaming encoder. At most `stream_window` frames per worker are in flight, and finished frames
+        are appended in order straight to the output file. The memory used stays flat no matter how big
+        the input is. `encode` streams the same way, this is kept as its alias.
 
-        # assuming all frames share same delay
-        control = GIFencoder.graphics_control_block(delay, trans_index)
-        # create an array to store multiprocessing results
-        frames = [None] * len(string_list)
-        # create a pool to dispatch frames encoding
-        pool1 = multiprocessing.Pool(processes=multiprocessing.cpu_count())  # use up all the cores.
+        :param input_file_path: input file path
+        :param output_gif_path: output gif file path
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: None
+        """
+        return self.encode(input_file_path, output_gif_path, mode)
 
-        for i, s in enumerate(string_list):
-            frames[i] = pool1.apply_async(self.gen_qr_render_frame, args=(qr, s, width, height, render, ))
+    def encode_incremental(self, input_file_path: str, output_gif_path: str, previous_gif_path: str = None,
+                           mode: str = 'b64'):
+        """
+        Encode a new revision of a file, rendering only the frames whose chunks changed.
+        The frames of the unchanged chunks are copied byte for byte out of the previous GIF, found by its
+        sidecar manifest or, when there is none, by decoding it. The GIF is the same as `encode_stream` writes,
+        and gets a manifest for the next revision.
+        Only the frames made with the same settings are reused. An edit that shifts the data, an insertion
+        in base64 mode or a `compression` of the file, changes all the chunks behind it. With `frame_header`
+        every frame carries the file id, a hash of the whole file, so no frame is reused.
 
-        # join the pool
-        pool1.close()
-        pool1.join()
+        :param input_file_path: input file path
+        :param output_gif_path: output gif file path
+        :param previous_gif_path: the GIF of the previous revision, defaults to `output_gif_path`, which is replaced
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: EncodeStats
+        """
+        job = (input_file_path, output_gif_path, previous_gif_path or output_gif_path)
+        with self.worker_pool() as pool1:
+            for stats in self.iter_encode([job], pool1, mode):
+                return stats
 
-        for i in range(len(string_list)):
-            surface.write(control + frames[i].get())
+    def previous_frames(self, previous_gif_path: str, spec, mode: str = 'b64'):
+        """
+        The frames of a previous GIF, by their keys with `spec`, backed by `frame_cache`.
+        The sidecar manifest indexes them when there is an up to date one, otherwise the GIF is decoded.
 
-        surface.save(output_gif_path)
-        surface.close()
-        return
+        :param previous_gif_path: the previous GIF
+        :param spec: the FrameSpec of the new frames
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: FrameCache.GIFFrames, None if there is no previous GIF
+        """
+        if not os.path.isfile(previous_gif_path):
+            return None
+        frames = FrameCache.GIFFrames.from_manifest(previous_gif_path, fallback=self.frame_cache)
+        if frames is None:
+            frames = FrameCache.GIFFrames(previous_gif_path, self.index_gif(previous_gif_path, spec, mode),
+                                          fallback=self.frame_cache)
+        return frames
+
+    def index_gif(self, gif_path: str, spec, mode: str = 'b64'):
+        """
+        Index the frames of a GIF written by `encode` by the keys of their chunks, see FrameCache.frame_key.
+        The frames are decoded like `decode_direct` does, the ones that do not read or were not made with the
+        version, error correction level and mask pattern of `spec` are left out.
+
+        :param gif_path: the GIF file
+        :param spec: the FrameSpec of the new frames
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: dict of key -> (offset, length) of the frames in the GIF
+        """
+        with open(gif_path, 'rb') as f:
+            data = f.read()
+
+        reader = QRFrame.QRFrameReader()
+        index = {}
+        try:
+            width, height, palette, frames = GIFdecoder.read_gif(data)
+            if (width, height) != (spec.width, spec.height):
+                return index
+            for i, frame in enumerate(frames):
+                if i == 0:
+                    continue  # skip the first black frame
+                try:
+                    chunk, version, error_correction, mask_pattern = self.read_frame(reader, frame, info=True)
+                except ValueError:
+                    continue
+                if (version, error_correction) != (spec.version, spec.error_correction) or \
+                        spec.mask_pattern is not None and mask_pattern != spec.mask_pattern:
+                    continue
+                chunk = self.payload(chunk if mode == 'bin' else chunk.decode(), mode)
+                index.setdefault(FrameCache.frame_key(spec, chunk), (frame.offset, frame.length))
+        except (ValueError, UnicodeDecodeError):
+            pass  # keep the frames read so far
+        return index
+
+    def encode_batch(self, jobs, mode: str = 'b64', plan=None):
+        """
+        Encode many files through one worker pool, the shared `pool` if set, see `iter_encode`.
+
+        :param jobs: iterable of (input file path, output gif path), or (input, output, previous gif path)
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :param plan: None to keep the settings, or a dict of QRPlanner targets to `plan` every file with, {} for none
+        :return: list of EncodeStats, in the order of the jobs
+        """
+        with self.worker_pool() as pool1:
+            return list(self.iter_encode(jobs, pool1, mode, plan))
+
+    def iter_encode(self, jobs, pool, mode: str = 'b64', plan=None):
+        """
+        Stream the frames of many files through the worker pool `pool`, like `encode_stream` does for one.
+        The window of `stream_window` frames per worker in flight spans the files: the frames of the next
+        file are dispatched while the last ones of the previous file are rendered, so the workers never
+        wait for a GIF to be closed. Each GIF is the same as `encode_stream` writes.
+        The frames of a small file are rendered inline while the pool is not started, see WorkerPool.runner.
+        A job with a previous GIF is encoded incrementally, see `encode_incremental`.
+        If the encoding fails, the GIFs not finished are removed, the GIFs already at their paths are left as they are.
+
+        :param jobs: iterable of (input file path, output gif path), or (input, output, previous gif path)
+        :param pool: the WorkerPool.WorkerPool, see `make_pool`
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :param plan: None to keep the settings, or a dict of QRPlanner targets to `plan` every file with, {} for none
+        :return: generator of EncodeStats, yielded as the GIFs are closed, in the order of the jobs
+        """
+        # checked before any GIF is opened, the parity frames come after all the data frames
+        if not 0 <= self.fec_ratio <= 1:
+            raise ValueError('fec_ratio should be in [0, 1], got ' + str(self.fec_ratio))
+        if not 1 <= self.fec_group <= QRContainer.MAX_GROUP:
+            raise ValueError('fec_group should be in 1-{}, got {}'.format(QRContainer.MAX_GROUP, self.fec_group))
+
+        max_in_flight = self.stream_window * multiprocessing.cpu_count()
+        # (_OutputGIF, frames, keys) for a task, keys None without manifest,
+        # (_OutputGIF, EncodeStats, None) once the last task of a file is sent
+        in_flight = collections.deque()
+        pending = {}
+        opened = []  # the surfaces of the GIFs not finished
+
+        def pop():
+            gif, item, keys = in_flight.popleft()
+            surface = gif.surface
+            if isinstance(item, EncodeStats):
+                surface.save()
+                opened.remove(surface)
+                if gif.previous is not None:
+                    gif.previous.close()
+                    item = item._replace(reused=item.frames - gif.previous.misses)
+                os.replace(surface.filename, gif.output)
+                if gif.manifest is not None:
+                    FrameCache.write_manifest(gif.output, gif.manifest)
+                elif os.path.exists(FrameCache.manifest_path(gif.output)):
+                    os.remove(FrameCache.manifest_path(gif.output))  # it describes the GIF replaced
+                return item._replace(seconds=time.time() - item.seconds)
+            for i, frame in enumerate(item.get()):
+                surface.write(gif.control)
+                if keys is not None:
+                    gif.manifest.append((keys[i], surface.tell(), len(frame)))
+                surface.write(frame)
+            return None
+
+        try:
+            for job in jobs:
+                input_file_path, output_gif_path = job[:2]
+                previous_gif_path = job[2] if len(job) > 2 else None
+                start = time.time()
+                if plan is not None:
+                    self.plan(input_file_path, mode, **plan)
+                frames = 0
+                # written aside and renamed once closed: a GIF already there, such as the previous revision
+                # still read while the new one is written, is left as it is if the encoding fails
+                gif_path = output_gif_path + '.part'
+                with self.open_input(input_file_path) as f:
+                    offset = f.tell()
+                    size = f.seek(0, 2) - offset
+                    f.seek(offset)
+                    # the cache, the manifest and the previous GIF key the frames by their chunks
+                    ranges = self.zero_copy and self.frame_cache is None and not self.frame_manifest and \
+                        previous_gif_path is None
+                    tasks = self.iter_frame_tasks(f, gif_path, mode, ranges)
+                    surface, control, spec = next(tasks)
+                    opened.append(surface)
+                    # the tasks sent are the batches of frames, their work depends on the size of the frames
+                    frame_total = QRPlanner.frame_total(size, self.chuck_length, mode, self.frame_header,
+                                                        self.fec_ratio, self.fec_group)
+                    runner = pool.runner(math.ceil(frame_total / self.frame_batch),
+                                         frame_total * QRPlanner.frame_work(spec.version, spec.border))
+                    previous = self.previous_frames(previous_gif_path, spec, mode) if previous_gif_path else None
+                    manifest = [] if self.frame_manifest or previous_gif_path else None
+                    gif = _OutputGIF(surface, control, output_gif_path, manifest, previous)
+                    for spec, batch in tasks:
+                        while len(in_flight) >= max_in_flight:
+                            stats = pop()
+                            if stats is not None:
+                                yield stats
+                        keys = [FrameCache.frame_key(spec, chunk) for chunk in batch] if manifest is not None else None
+                        in_flight.append((gif, self.render_async(runner, spec, batch, pending, previous), keys))
+                        frames += batch.stop - batch.start if isinstance(batch, ChunkRange) else len(batch)
+                in_flight.append((gif, EncodeStats(input_file_path, output_gif_path,
+                                                   os.path.getsize(input_file_path), frames, start), None))
+            while in_flight:
+                stats = pop()
+                if stats is not None:
+                    yield stats
+        except BaseException:
+            for surface in opened:
+                surface.close()
+                os.remove(surface.filename)
+            raise
+
+    def iter_frame_tasks(self, f, output_gif_path: str, mode: str = 'b64', ranges=False):
+        """
+        Open the output GIF of a file and generate the rendering tasks of its frames.
+        The first item is (GIFSurface.GIFFileSurface, graphics control block, FrameSpec): each rendered frame
+        should be written to the surface in order behind the control block, and the surface saved after the last one.
+        The next items are (FrameSpec, chunks) batches of frames, to render with `render_async`.
+        With `ranges` the batches of an unframed file on disk are ChunkRange, the file is not read here.
+
+        :param f: file object opened in 'rb' mode, see `open_input`
+        :param output_gif_path: output gif file path
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :param ranges: send ChunkRange batches when the file allows it, see `zero_copy`
+        :return: generator of (surface, control block, FrameSpec), then of (FrameSpec, chunks)
+        """
+        offset = f.tell()
+        size = f.seek(0, 2) - offset
+        f.seek(offset)
+        version = self.fit_version(size, mode)
+
+        path = getattr(f, 'name', None)  # a temporary file of the compressed input has none, or its descriptor
+        if ranges and not self.frame_header and isinstance(path, str):
+            revision = file_revision(f)
+            total = QRContainer.frame_count(size, self.chuck_length, mode)
+            chunk_range = ChunkRange(os.path.abspath(path), offset, size, revision, mode, self.chuck_length, 0, 0)
+            first_chunk = read_chunks(chunk_range._replace(stop=1))[0] if total else ''
+            batches = (chunk_range._replace(start=i, stop=min(i + self.frame_batch, total))
+                       for i in range(0, total, self.frame_batch))
+        else:
+            chunks = self.iter_payloads(f, mode)
+            first_chunk = next(chunks, '')
+            batches = self.iter_batches(itertools.chain([first_chunk] if first_chunk else [], chunks))
+
+        border = 2
+        width = height = version * 4 + 17 + 2 * border
+
+        cmap = {True: 0, False: 1}  # Black -> True -> (0, 0, 0)
+        mcl = 2
+        control = GIFencoder.graphics_control_block(self.GIF_delay, None)
+        spec = self.frame_spec(version, border, first_chunk, width, height, cmap, mcl)
+        surface = GIFSurface.GIFFileSurface(output_gif_path, width, height, [0, 0, 0, 255, 255, 255], bg_color=0)
+        yield surface, control, spec
+
+        for batch in batches:
+            yield spec, batch
 
     def encode_without_mp(self, input_file_path: str, output_gif_path: str):
         """
@@ -186,9 +789,11 @@ class QRCodec:
     def decode(input_gif_path, output_file_path, mode: str = 'b64'):
         """
         Decode the GIF to recover its binary file entity.
+        Note zbar may transcode the text of byte mode segments, use `decode_direct` for 'bin' GIFs.
 
         :param input_gif_path: input GIF file
         :param output_file_path: output binary file, use extension to decide file type.
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
         :return: None
         """
         if type(input_gif_path) is str:
@@ -196,7 +801,7 @@ class QRCodec:
         else:
             return
 
-        decoded_string = ''
+        decoded_chunks = []
         frame_count = 0
         for frame in ImageSequence.Iterator(img):
             frame_count += 1
@@ -206,19 +811,189 @@ class QRCodec:
             (width, height) = (frame.width * 2, frame.height * 2)
             im_resized = frame.resize((width, height))
             decoded = QRdecode(im_resized)
-            decoded_string += decoded[0].data.decode('ascii')
+            decoded_chunks.append(decoded[0].data if decoded else None)
 
         print('total frame count is', str(frame_count))
-        decoded_string = decoded_string.replace('$', '=')  # recover padding
 
-        file_bin = None
+        QRCodec.write_decoded(decoded_chunks, output_file_path, mode)
+        return
+
+    @staticmethod
+    def decode_frame(size, pixels):
+        """
+        A wrapper function to run in multiprocessing.
+        Detect the QR code of one frame and return its data.
+
+        :param size: (width, height) of the frame
+        :param pixels: the frame as 8-bit grayscale bytes
+        :return: the decoded bytes, None if no QR code is found
+        """
+        frame = Image.frombytes('L', size, pixels)
+        # the decode CV lib relies on the dimensions, 1px width cannot be recognized
+        im_resized = frame.resize((size[0] * 2, size[1] * 2))
+        decoded = QRdecode(im_resized)
+        return decoded[0].data if decoded else None
+
+    @staticmethod
+    def iter_decoded_bytes(strings, mode: str = 'b64'):
+        """
+        Decode a stream of base64/base32 string chunks block by block.
+        Only whole 4 (base64) or 8 (base32) character groups are decoded at a time,
+        the rest is carried over to the next chunk. 'bin' chunks are the file bytes already.
+
+        :param strings: iterable of the data of the frames as bytes, in order
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: generator of bytes
+        """
         if mode == 'b64':
-            file_bin = base64.b64decode(decoded_string)
-        if mode == 'b32':
-            file_bin = base64.b32decode(decoded_string)
+            group, b_decode = 4, base64.b64decode
+        elif mode == 'b32':
+            group, b_decode = 8, base64.b32decode
+        elif mode == 'bin':
+            for s in strings:
+                if s is None:
+                    raise ValueError('A frame could not be decoded.')
+                yield s
+            return
+        else:
+            raise ValueError('unknown mode: ' + str(mode))
+
+        rest = b''
+        for s in strings:
+            if s is None:
+                raise ValueError('A frame could not be decoded.')
+            s = rest + s.replace(b'$', b'=')  # recover padding
+            end = len(s) - len(s) % group
+            if end:
+                yield b_decode(s[:end])
+            rest = s[end:]
+        if rest:
+            yield b_decode(rest)
+
+    @staticmethod
+    def write_decoded(strings, output_file_path, mode: str = 'b64'):
+        """
+        Write the data of the frames to the output file. Framed GIFs, see `frame_header`, go through
+        QRContainer.FrameWriter: the frames may come in any order, duplicates and other files' frames
+        are skipped, and the file is checked against the trailer. Other GIFs are joined in frame order.
+        A GIF is taken for framed by its first frame that could be decoded, lost frames before it are kept.
+        A file encoded with `compression` is decompressed once written.
+
+        :param strings: iterable of the data of the frames as bytes, None for a frame that could not be decoded
+        :param output_file_path: output binary file
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: None
+        """
+        strings = iter(strings)
+        head = []
+        for s in strings:
+            head.append(s)
+            if s is not None:
+                break
+        strings = itertools.chain(head, strings)
         with open(output_file_path, 'wb') as f:
-            f.write(file_bin)
-        f.close()
+            if head and head[-1] is not None and QRContainer.has_header(head[-1], mode):
+                writer = QRContainer.FrameWriter(f, mode)
+                for s in strings:
+                    writer.add(s)
+                writer.close()
+            else:
+                for block in QRCodec.iter_decoded_bytes(strings, mode):
+                    f.write(block)
+        Compression.decompress_file(output_file_path)
+        return
+
+    def decode_parallel(self, input_gif_path, output_file_path, mode: str = 'b64'):
+        """
+        The parallel decoder. Frames are read in this process and the QR detection
+        of each frame is fanned out to the worker pool. At most `stream_window` frames
+        per worker are in flight, the strings are collected in frame order and
+        decoded straight into the output file.
+
+        :param input_gif_path: input GIF file
+        :param output_file_path: output binary file, use extension to decide file type.
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: None
+        """
+        img = Image.open(input_gif_path)  # GIF file
+
+        def iter_strings(pool):
+            max_in_flight = self.stream_window * multiprocessing.cpu_count()
+            in_flight = collections.deque()
+            for i, frame in enumerate(ImageSequence.Iterator(img)):
+                if i == 0:
+                    continue  # skip the first black frame
+                if len(in_flight) >= max_in_flight:
+                    yield in_flight.popleft().get()
+                frame = frame.convert('L')
+                in_flight.append(pool.apply_async(self.decode_frame, args=(frame.size, frame.tobytes(), )))
+            while in_flight:
+                yield in_flight.popleft().get()
+
+        try:
+            with self.worker_pool() as pool1:
+                self.write_decoded(iter_strings(pool1), output_file_path, mode)
+        finally:
+            img.close()
+        return
+
+    def read_frame(self, reader, frame, info=False):
+        """
+        Read the data of a frame parsed by GIFdecoder straight from its pixels,
+        each pixel being one module. A frame that does not read as a QR matrix
+        is handed to pyzbar, or raises ValueError with `info`.
+
+        :param reader: the QRFrame.QRFrameReader object
+        :param frame: the GIFdecoder.Frame
+        :param info: also return what the matrix was made with, see QRFrameReader.decode
+        :return: the decoded bytes, or (bytes, version, error correction, mask pattern) with `info`
+        """
+        palette = frame.palette
+        luminance = bytes((palette[3 * i] * 299 + palette[3 * i + 1] * 587 + palette[3 * i + 2] * 114) // 1000
+                          if 3 * i + 2 < len(palette) else 0 for i in range(256))
+        dark = bytes(1 if lum < 128 else 0 for lum in luminance)
+
+        modules = frame.pixels.translate(dark)
+        w = frame.width
+        try:
+            if frame.width != frame.height:
+                raise ValueError('Not a QR matrix.')
+            return reader.decode([modules[i:i + w] for i in range(0, len(modules), w)], info)
+        except ValueError:
+            if info:
+                raise
+            return self.decode_frame((frame.width, frame.height), frame.pixels.translate(luminance))
+
+    def decode_direct(self, input_gif_path, output_file_path, mode: str = 'b64'):
+        """
+        The fast-path decoder for the GIFs written by `encode`. Frames are LZW decompressed
+        by GIFdecoder and the QR data is read straight from the module grid, without PIL
+        nor any symbol detection. Frames that do not read are handed to pyzbar, and GIFs
+        GIFdecoder cannot parse, or not made of full size frames, go through `decode`.
+
+        :param input_gif_path: input GIF file
+        :param output_file_path: output binary file, use extension to decide file type.
+        :param mode: b64 for base64 encode, b32 for base32 encode, bin for the raw bytes in byte mode
+        :return: None
+        """
+        with open(input_gif_path, 'rb') as f:
+            data = f.read()
+
+        reader = QRFrame.QRFrameReader()
+        strings = []
+        try:
+            width, height, palette, frames = GIFdecoder.read_gif(data)
+            for i, frame in enumerate(frames):
+                if i == 0:
+                    continue  # skip the first black frame
+                if (frame.left, frame.top, frame.width, frame.height) != (0, 0, width, height):
+                    raise ValueError('Frames are not full size.')
+                strings.append(self.read_frame(reader, frame))
+        except ValueError:
+            # not a GIF written by QRCodec, fall back to locating the QR codes in image space
+            return self.decode(input_gif_path, output_file_path, mode)
+
+        self.write_decoded(strings, output_file_path, mode)
         return
 
 
@@ -232,17 +1007,20 @@ def main():
     t = time.time()
     q.encode(input_file_path=input_path, output_gif_path=save_path)
     # q.encode_without_mp(input_file_path=input_path, output_gif_path=save_path)
+    # q.encode_stream(input_file_path=input_path, output_gif_path=save_path)  # flat memory for huge files
     print("Encode benchmark", time.time() - t)
     print('decode')
     q.decode(save_path, output_path)
+    # q.decode_parallel(save_path, output_path)  # QR detection on all the cores
+    # q.decode_direct(save_path, output_path)  # read the module grids of our own GIFs, no detection
     return
 
 
 def byte_test():
     q = QRCodec()
-    q.chuck_length = 2953
     input_path = '../test_images/ECE564.png'
-    save_path = '../test_images/b64_v40_2953.gif'
+    q.plan(input_path, mode='b64', error_correction=qrcode.constants.ERROR_CORRECT_L)
+    save_path = '../test_images/b64_v{}_{}.gif'.format(q.qr_version, q.chuck_length)
     output_path = '../test_images/face3.png'
 
     print('encode')
@@ -254,6 +1032,117 @@ def byte_test():
     return
 
 
+def expand_inputs(specs, manifest=None):
+    """
+    List the files to encode: files, directories, whose files are taken, glob patterns,
+    and the lines of a manifest file, blank lines and lines starting with # skipped.
+    The files the encoder writes, GIFs, their .part files and their sidecar manifests,
+    are left out of directories and glob patterns, for a second run not to encode them.
+
+    :param specs: list of paths, directories and glob patterns
+    :param manifest: path of the manifest file, None for none
+    :return: list of file paths, without duplicates, in the order given
+    """
+    specs = list(specs)
+    if manifest is not None:
+        with open(manifest) as f:
+            specs += [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    outputs = ('.gif', '.gif.part', FrameCache.manifest_path('.gif'))
+    paths = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            found = sorted(os.path.join(spec, name) for name in os.listdir(spec))
+        elif glob.has_magic(spec):
+            found = sorted(glob.glob(spec, recursive=True))
+        else:
+            paths.append(spec)
+            continue
+        paths += [path for path in found if not path.lower().endswith(outputs)]
+    # the same file spelled two ways is encoded once
+    unique = {}
+    for path in paths:
+        unique.setdefault(os.path.abspath(path), path)
+    return [path for path in unique.values() if os.path.isfile(path)]
+
+
+def cli():
+    import argparse
+    parser = argparse.ArgumentParser(description="Encode files to GIFs of QR codes, through one worker pool")
+    parser.add_argument("inputs", nargs="*", help="Files, directories or glob patterns to encode.")
+    parser.add_argument("-m", "--manifest", help="File listing the inputs, one per line.")
+    parser.add_argument("-o", "--output", help="Directory of the GIFs, next to the inputs by default.")
+    parser.add_argument("--mode", choices=["b64", "b32", "bin"], default="b64", help="Payload encoding.")
+    parser.add_argument("-v", "--version", type=int, help="QR version. In range of [1-40]")
+    parser.add_argument("-e", "--errorcorrect", choices=["L", "M", "Q", "H"], help="Error correct")
+    parser.add_argument("-l", "--length", type=int, help="Chunk length, see chuck_length.")
+    parser.add_argument("-p", "--plan", action="store_true", help="Plan version, error correct and chunk length per file.")
+    parser.add_argument("--max-frames", type=int, help="With --plan, the most frames per GIF.")
+    parser.add_argument("--max-bytes", type=int, help="With --plan, the largest GIF in bytes.")
+    parser.add_argument("-z", "--compression", choices=["auto"] + Compression.available_methods(),
+                        help="Compress the files first.")
+    parser.add_argument("-f", "--frame-header", action="store_true", help="Framed container, see frame_header.")
+    parser.add_argument("--fec", type=float, default=0, help="With --frame-header, parity frames per data frame.")
+    parser.add_argument("-t", "--threads", action="store_true", help="Use a thread pool instead of processes.")
+    parser.add_argument("--cache", help="Directory keeping the rendered frames across runs, see frame_cache.")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="Reuse the unchanged frames of the GIFs already there, see encode_incremental.")
+    args = parser.parse_args()
+
+    q = QRCodec()
+    if args.version:
+        q.qr_version = args.version
+    if args.errorcorrect:
+        q.err_crt = getattr(qrcode.constants, 'ERROR_CORRECT_' + args.errorcorrect)
+    if args.length:
+        q.chuck_length = args.length
+    q.compression = args.compression
+    q.frame_header = args.frame_header
+    q.fec_ratio = args.fec
+    if args.threads:
+        q.pool_type = 'thread'
+    if args.cache:
+        q.frame_cache = FrameCache.FrameCache(path=args.cache)
+    plan = None
+    if args.plan:
+        plan = {'max_frames': args.max_frames, 'max_bytes': args.max_bytes,
+                'error_correction': q.err_crt if args.errorcorrect else None}
+
+    paths = expand_inputs(args.inputs, args.manifest)
+    if not paths:
+        parser.error('no input file')
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    jobs = [(path, os.path.join(args.output or os.path.dirname(path), os.path.basename(path) + '.gif'))
+            for path in paths]
+    # with -o, files of the same name in different directories would write the same GIF
+    written = collections.Counter(os.path.abspath(gif) for _, gif in jobs)
+    written.update(os.path.abspath(path) for path in paths)
+    clashes = sorted(gif for gif, n in written.items() if n > 1)
+    if clashes:
+        parser.error('GIFs written twice or over an input: ' + ', '.join(clashes))
+    if args.incremental:
+        jobs = [(path, gif, gif) for path, gif in jobs]
+
+    t = time.time()
+    size = frames = 0
+    # the version is chosen per file with --plan
+    with q.make_pool(templates=[] if args.plan else None) as pool1:
+        for stats in q.iter_encode(jobs, pool1, args.mode, plan):
+            size += stats.size
+            frames += stats.frames
+            print('{}  {} bytes  {} frames  {:.2f}s  {:.1f} KB/s'.format(
+                stats.output, stats.size, stats.frames, stats.seconds, stats.size / 1024 / max(stats.seconds, 1e-9))
+                + ('  {} reused'.format(stats.reused) if args.incremental else ''))
+    t = time.time() - t
+    print('{} files  {} bytes  {} frames  {:.2f}s  {:.1f} KB/s  {:.1f} frames/s'.format(
+        len(jobs), size, frames, t, size / 1024 / t, frames / t))
+    if q.frame_cache is not None:
+        print('frame cache  {} hits ({} from disk)  {} misses'.format(
+            q.frame_cache.hits, q.frame_cache.disk_hits, q.frame_cache.misses))
+    return
+
+
 if __name__ == '__main__':
     # main()
-    byte_test()
+    # byte_test()
+    cli()
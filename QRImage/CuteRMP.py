@@ -1,23 +1,51 @@
 from PIL import Image
 from PIL import ImageEnhance
 from PIL import ImageSequence
+from collections import OrderedDict
+from collections import deque
 import qrcode
 import imageio
+import itertools
 import multiprocessing
+import os
+import threading
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, produce_impl falls back to the pixel loop
+    np = None
 
-def color_replace(image, color):
-    """Replace black with other color
+# the (keep, center) masks of the QR area, by (img_size, padding), see module_masks
+_module_masks = {}
+
+# the QR templates of this process, by their arguments, the most recent last, see get_template
+_templates = OrderedDict()
+_templates_lock = threading.Lock()  # the threads of a thread pool share them
+MAX_TEMPLATES = 8
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+STREAM_WINDOW = 4  # frames in flight per worker in iter_produce, bounds the memory used
+
+
+def color_replace(image, color, vectorize=None):
+    """Replace black with other color, in place
 
     :color: custom color (r,g,b,a)
-    :image: image to replace color
-    :returns: TODO
+    :image: RGBA image to replace color
+    :vectorize: recolor with NumPy, defaults to True when NumPy is installed
+    :returns: None
 
     """
+    if vectorize is None:
+        vectorize = np is not None
+    if vectorize:
+        pixels = np.array(image)
+        recolor(pixels, color)
+        image.frombytes(pixels.tobytes())
+        return
     pixels = image.load()
-    size = image.size[0]
-    for width in range(size):
-        for height in range(size):
+    for width in range(image.size[0]):
+        for height in range(image.size[1]):
             r, g, b, a = pixels[width, height]
             if (r, g, b, a) == (0,0,0,255):
                 pixels[width,height] = color
@@ -25,24 +53,146 @@ def color_replace(image, color):
                 pixels[width,height] = (r,g,b,color[3])
 
 
+def recolor(pixels, color):
+    """Replace black with other color in an RGBA array, in place
+
+    Opaque black pixels become `color`, the others get its alpha.
+
+    :pixels: uint8 array of shape (height, width, 4), such as a view of a shared buffer
+    :color: custom color (r,g,b,a)
+    :returns: pixels
+
+    """
+    if pixels.strides[-2:] == (4, 1):
+        # each pixel read as one 32 bits word, compared and written at once
+        words = pixels.view(np.uint32)[..., 0]
+        black = words == np.frombuffer(bytes((0, 0, 0, 255)), dtype=np.uint32)[0]
+        pixels[..., 3] = color[3]
+        words[black] = np.frombuffer(bytes(color), dtype=np.uint32)[0]
+    else:
+        black = (pixels == np.array((0, 0, 0, 255), dtype=np.uint8)).all(axis=-1)
+        pixels[..., 3] = color[3]
+        pixels[black] = color
+    return pixels
+
+
+def module_masks(img_size, padding):
+    """The masks of the QR area deciding which pixels of the QR layer are kept
+
+    :img_size: side of the QR area, the QR image without its padding
+    :padding: padding around the QR area
+    :returns: (keep, center) boolean arrays indexed [y, x], the finder patterns
+        always kept and the center pixels of the modules
+
+    """
+    key = (img_size, padding)
+    if key not in _module_masks:
+        comp_pad = 12 - padding
+        x = np.arange(img_size)
+        near = (comp_pad <= x) & (x < 21 + comp_pad)
+        far = (img_size - 22 - comp_pad < x) & (x < img_size - comp_pad)
+        keep = near[None, :] & (near[:, None] | far[:, None]) | far[None, :] & near[:, None]
+        center = x % 3 == 1
+        _module_masks[key] = (keep, center[:, None] & center[None, :])
+    return _module_masks[key]
+
+
+def blend_modules(img_frame, img_frame_l, img_enh_l, img_size, padding):
+    """Clear the pixels of the QR layer the image shows through
+
+    A pixel is kept in the finder patterns, or at the center of a module
+    whose color stands out from the image under it.
+
+    :img_frame: the QR layer, RGBA
+    :img_frame_l: the QR layer in luminance
+    :img_enh_l: the image in luminance, img_size x img_size
+    :img_size: side of the QR area
+    :padding: padding around the QR area
+    :returns: the new QR layer
+
+    """
+    keep, center = module_masks(img_size, padding)
+    box = slice(padding, padding + img_size)
+    qr_l = np.asarray(img_frame_l)[box, box]
+    img_l = np.asarray(img_enh_l)
+    keep = keep | center & (((qr_l > 70) & (img_l < 185)) | ((qr_l < 185) & (img_l > 70)))
+    pixels = np.array(img_frame)
+    pixels[box, box][~keep] = 0
+    return Image.fromarray(pixels, 'RGBA')
+
+
+class QRTemplate(object):
+    """The parts of a produced frame that only depend on the QR code
+
+    Built once and shared by all the frames of a produce() call, so that a frame
+    only blends its image with the QR layer.
+    """
+    def __init__(self, txt, ver=5, err_crt=qrcode.constants.ERROR_CORRECT_H, colourful=False, rgba=(0,0,0,255), padding=12):
+        """
+        :txt: QR text
+        :ver: QR version
+        :err_crt: QR error correct
+        :colourful: If colourful mode
+        :rgba: color to replace black
+        :padding: padding around the QR area
+        """
+        qr = qrcode.QRCode(version=ver, error_correction=err_crt, box_size=3)
+        qr.add_data(txt)
+        qr.make(fit=True)
+        self.version = qr.version
+        self.padding = padding
+        # the module matrix, border included
+        self.matrix = qr.get_matrix()
+        img_base = qr.make_image().convert('RGBA')
+
+        # the QR layer and its luminance, the image shows through the layer where they agree
+        self.layer = img_base.copy()
+        if colourful and (rgba != (0, 0, 0, 255)):
+            color_replace(self.layer, rgba)
+        self.layer_l = self.layer.convert('L')
+        self.size = self.layer.size[0]
+
+        # the alignment boxes, pasted back over the blend. the lower right locate box is not one of them
+        img_qr2 = img_base
+        if colourful and (rgba != (0, 0, 0, 0)):
+            color_replace(img_qr2, rgba)
+        pos = qrcode.util.pattern_position(qr.version)
+        self.patches = []
+        for i in pos:
+            for j in pos:
+                if (i == 6 and j == pos[-1]) or (j == 6 and i == pos[-1]) \
+                        or (i == 6 and j == 6):
+                    continue
+                rect = (3 * (i - 2) + 12, 3 * (j - 2) + 12, 3 * (i + 3) + 12, 3 * (j + 3) + 12)
+                self.patches.append((rect, img_qr2.crop(rect)))
+
+
+def get_template(txt, ver=5, err_crt=qrcode.constants.ERROR_CORRECT_H, colourful=False, rgba=(0,0,0,255), padding=12):
+    """The QRTemplate of these arguments, built once per process
+
+    :returns: QRTemplate
+
+    """
+    key = (txt, ver, err_crt, colourful, tuple(rgba), padding)
+    with _templates_lock:
+        if key not in _templates:
+            _templates[key] = QRTemplate(txt, ver, err_crt, colourful, rgba, padding)
+            while len(_templates) > MAX_TEMPLATES:
+                _templates.popitem(last=False)
+        _templates.move_to_end(key)
+        return _templates[key]
+
+
 def decode_video_file(filename, crop=False, crop_box=None):
     """
 
     :param filename: video filename
     :param crop: either crop or not
     :param crop_box: the crop rectangle defined in PIL format
-    :return: list of images
+    :return: list of images, see iter_video_frames to read them one at a time instead
     """
-    image_stack = []
-    i = 0
-    vid = imageio.get_reader(filename, 'ffmpeg')
-    for img in enumerate(vid):
-        i = i + 1
-        img = Image.fromarray(img[1])
-        img = img.convert('RGBA')
-        if crop:
-            img = img.crop(crop_box)
-        image_stack.append(img)
+    image_stack = list(iter_video_frames(filename, crop_box if crop else None))
+    i = len(image_stack)
     if i > 120:
         info_str = 'total frames is: ' + str(i) + ', you might want to change max_frames setting.'
     else:
@@ -55,12 +205,75 @@ def decode_video_file(filename, crop=False, crop_box=None):
     return image_stack
 
 
+def prepare_frame(img, crop_box=None, max_size=None):
+    """Crop and downscale a frame as it arrives
+
+    :img: Image object
+    :crop_box: the crop rectangle defined in PIL format, None to keep the whole frame
+    :max_size: the longest side allowed, a larger frame is downscaled keeping its ratio, None for no limit
+    :returns: the frame, a new Image object
+
+    """
+    if crop_box is not None:
+        img = img.crop(crop_box)
+    if max_size is not None and max(img.size) > max_size:
+        scale = max_size / max(img.size)
+        return img.resize((max(1, round(img.size[0] * scale)), max(1, round(img.size[1] * scale))))
+    return img.copy() if crop_box is None else img
+
+
+def iter_video_frames(filename, crop_box=None, stride=1, max_size=None):
+    """Read a video file one frame at a time
+
+    :filename: video filename
+    :crop_box: the crop rectangle defined in PIL format, None to keep the whole frames
+    :stride: keep one frame out of `stride`
+    :max_size: see prepare_frame
+    :returns: generator of RGBA images
+
+    """
+    if stride < 1:
+        raise ValueError('stride should be at least 1, got ' + str(stride))
+    vid = imageio.get_reader(filename, 'ffmpeg')
+    try:
+        for i, frame in enumerate(vid):
+            if i % stride == 0:
+                yield prepare_frame(Image.fromarray(frame).convert('RGBA'), crop_box, max_size)
+    finally:
+        vid.close()
+
+
+def iter_frames(img, stride=1, crop_box=None, max_size=None):
+    """The frames to produce, read one at a time
+
+    :img: a video or image path, an Image object, animated or not, or an iterable of Image objects
+    :stride: keep one frame out of `stride`
+    :crop_box: the crop rectangle defined in PIL format, None to keep the whole frames
+    :max_size: see prepare_frame
+    :returns: generator of images
+
+    """
+    if stride < 1:
+        raise ValueError('stride should be at least 1, got ' + str(stride))
+    if isinstance(img, str):
+        if os.path.splitext(img)[1].lower() in VIDEO_EXTENSIONS:
+            yield from iter_video_frames(img, crop_box, stride, max_size)
+            return
+        with Image.open(img) as opened:  # GIF file or single frame image
+            yield from iter_frames(opened, stride, crop_box, max_size)
+        return
+    frames = ImageSequence.Iterator(img) if isinstance(img, Image.Image) else img
+    for i, frame in enumerate(frames):
+        if i % stride == 0:
+            yield prepare_frame(frame, crop_box, max_size)
+
+
 def produce(txt,img,ver=5,err_crt = qrcode.constants.ERROR_CORRECT_H,bri = 1.0, cont = 1.0,\
-        colourful = False, rgba = (0,0,0,255),pixelate = False, padding=12):
+        colourful = False, rgba = (0,0,0,255),pixelate = False, padding=12, pool=None, stride=1, crop_box=None, max_size=None, scale=None):
     """Produce QR code
 
     :txt: QR text
-    :img: Image path / Image object
+    :img: Image path / Image object / list of Image objects
     :ver: QR version
     :err_crt: QR error correct
     :bri: Brightness enhance
@@ -68,49 +281,80 @@ def produce(txt,img,ver=5,err_crt = qrcode.constants.ERROR_CORRECT_H,bri = 1.0,
     :colourful: If colourful mode
     :rgba: color to replace black
     :pixelate: pixelate
-    :returns: list of produced image
+    :pool: a worker pool to reuse, such as QRCodec's WorkerPool, left open. None creates one for 5 frames or more
+    :stride: keep one frame out of `stride`
+    :crop_box: the crop rectangle defined in PIL format, None to keep the whole frames
+    :max_size: the longest side of the frames, larger ones are downscaled, None for no limit
+    :scale: output pixels per pixel of the QR image, see produce_impl
+    :returns: list of produced image, see iter_produce to get them as they are done
 
     """
-    if type(img) is Image.Image:
-        pass
-    elif type(img) is str:
-        if '.mp4' in img or '.mov' in img:
-            img = decode_video_file(img)  # video file
-        else:
-            img = Image.open(img)  # GIF file or single frame image
-    else:
+    if not isinstance(img, (str, Image.Image, list, tuple)):
         return []
+    return list(iter_produce(txt, img, ver, err_crt, bri, cont, colourful, rgba, pixelate, padding, pool,
+                             stride, crop_box, max_size, scale))
+
+
+def iter_produce(txt,img,ver=5,err_crt = qrcode.constants.ERROR_CORRECT_H,bri = 1.0, cont = 1.0,\
+        colourful = False, rgba = (0,0,0,255),pixelate = False, padding=12, pool=None, stride=1, crop_box=None, max_size=None, scale=None):
+    """Produce QR code frames as a stream
 
-    frame_count = 0
-    for _ in ImageSequence.Iterator(img):
-        frame_count += 1
+    The frames are read one at a time, see iter_frames, and at most `STREAM_WINDOW`
+    frames per worker are in flight, so the memory used does not grow with the
+    length of the clip and the first frames come out while the next ones are read.
+    The arguments are the ones of produce.
+
+    :returns: generator of produced image, in order
+
+    """
+    frames = iter_frames(img, stride, crop_box, max_size)
+    args = (ver, err_crt, bri, cont, colourful, rgba, pixelate, padding)
+    kwds = {'scale': scale}
+    # the QR code is the same for every frame, the workers build it once too
+    get_template(txt, ver, err_crt, colourful, rgba, padding)
+
+    head = list(itertools.islice(frames, 5))
+    frame_count = len(head) if len(head) < 5 else None  # unknown until the source is read
+    frames = itertools.chain(head, frames)
+
+    # a shared pool decides by itself whether the frames are worth sending to its workers
+    if pool is not None:
+        runner = pool.runner(frame_count) if hasattr(pool, 'runner') else pool
+        processes = getattr(pool, 'processes', None) or multiprocessing.cpu_count()
+        yield from _stream(runner, txt, frames, args, kwds, STREAM_WINDOW * processes)
+        return
 
     # if there are not too many images, just linear block process
-    if frame_count < 5:
-        frames = [produce_impl(txt, frame.copy(), ver, err_crt, bri, cont, colourful, rgba, pixelate, padding) for frame in ImageSequence.Iterator(img)]
-        return frames
+    if frame_count is not None:
+        for frame in frames:
+            yield produce_impl(txt, frame, *args, **kwds)
+        return
 
     # else to create a pool
     pool1 = multiprocessing.Pool(processes=multiprocessing.cpu_count())  # use up all the cores.
-    procs = [None] * frame_count
-    frames = [None] * frame_count
-
-    i = 0
-    for frame in ImageSequence.Iterator(img):
-        procs[i] = pool1.apply_async(produce_impl, args=(txt, frame.copy(), ver, err_crt, bri, cont, colourful, rgba, pixelate, padding))
-        i += 1
-        print('Frame ', str(i), ' added to pool.')
-    # wait until all frames are done
-    pool1.close()
-    pool1.join()
+    try:
+        yield from _stream(pool1, txt, frames, args, kwds, STREAM_WINDOW * multiprocessing.cpu_count())
+    except BaseException:
+        pool1.terminate()
+        raise
+    else:
+        pool1.close()
+    finally:
+        pool1.join()
 
-    for i in range(frame_count):
-        frames[i] = procs[i].get()
 
-    return frames
+def _stream(runner, txt, frames, args, kwds, window):
+    """Send the frames to `runner` with at most `window` in flight, yield the produced ones in order"""
+    in_flight = deque()
+    for frame in frames:
+        if len(in_flight) >= window:
+            yield in_flight.popleft().get()
+        in_flight.append(runner.apply_async(produce_impl, args=(txt, frame) + args, kwds=kwds))
+    while in_flight:
+        yield in_flight.popleft().get()
 
 
-def produce_impl(txt, img, ver=5, err_crt=qrcode.constants.ERROR_CORRECT_H, bri=1.0, cont=1.0, colourful=False, rgba=(0,0,0,255), pixelate=False, padding=12, animated=False):
+def produce_impl(txt, img, ver=5, err_crt=qrcode.constants.ERROR_CORRECT_H, bri=1.0, cont=1.0, colourful=False, rgba=(0,0,0,255), pixelate=False, padding=12, animated=False, vectorize=None, template=None, scale=None):
     """Produce QR code
 
     :txt: QR text
@@ -122,22 +366,22 @@ def produce_impl(txt, img, ver=5, err_crt=qrcode.constants.ERROR_CORRECT_H, bri=
     :colourful: If colourful mode
     :rgba: color to replace black
     :pixelate: pixelate
+    :vectorize: blend with NumPy masks, defaults to True when NumPy is installed
+    :template: the QRTemplate of the other arguments, see get_template
+    :scale: output pixels per pixel of the QR image, the frame is blended at that resolution.
+        None for 10, or for 1 with pixelate, whose output is brought back to the QR image size anyway
     :returns: Produced image
 
     """
-    qr = qrcode.QRCode(version=ver, error_correction=err_crt, box_size=3)
-    qr.add_data(txt)
-    qr.make(fit=True)
-    img_qr = qr.make_image().convert('RGBA')
-    if colourful and (rgba != (0, 0, 0, 255)):
-        color_replace(img_qr, rgba)
+    if template is None:
+        template = get_template(txt, ver, err_crt, colourful, rgba, padding)
     if animated:
         img_img = img.convert('RGB').convert('RGBA')  # the notorious Pilow GIF RGBA conversion bug. one workaround is in my emoticon generator
     else:
         img_img = img.convert('RGBA')
 
     img_img_size = None
-    img_size = img_qr.size[0] - padding * 2
+    img_size = template.size - padding * 2
     if img_img.size[0] < img_img.size[1]:
         img_img_size = img_img.size[0]
     else:
@@ -153,50 +397,60 @@ def produce_impl(txt, img, ver=5, err_crt=qrcode.constants.ERROR_CORRECT_H, bri=
             img_enh = img_enh.convert('1').convert('RGBA')
         else:
             img_enh = img_enh.convert('L').convert('RGBA')
-    img_frame = img_qr
-    img_enh = img_enh.resize((img_size * 10, img_size * 10))
+    img_frame = template.layer.copy()
+    if scale is None:
+        scale = 1 if pixelate else 10
+    img_enh = img_enh.resize((img_size * scale, img_size * scale))
     img_enh_l = img_enh.convert("L").resize((img_size, img_size))
-    img_frame_l = img_frame.convert("L")
+    img_frame_l = template.layer_l
+
+    if vectorize is None:
+        vectorize = np is not None
+    if vectorize and np is None:
+        raise ValueError('NumPy is required for the vectorized blend.')
 
-    comp_pad = 12 - padding
     # fill in not important pixels with image background
-    for x in range(0, img_size):
-        for y in range(0, img_size):
-            if comp_pad <= x < 21 + comp_pad and (comp_pad <= y < 21 + comp_pad or img_size - comp_pad > y > img_size - 22 - comp_pad):
-                continue
-            if img_size - comp_pad > x > img_size - 22 - comp_pad and (comp_pad <= y < 21 + comp_pad):
-                continue
-            if (x % 3 == 1 and y % 3 == 1):
-                if (img_frame_l.getpixel((x + padding, y + padding)) > 70 and img_enh_l.getpixel((x, y)) < 185) \
-                        or (img_frame_l.getpixel((x + padding, y + padding)) < 185 and img_enh_l.getpixel((x, y)) > 70):
+    if vectorize:
+        img_frame = blend_modules(img_frame, img_frame_l, img_enh_l, img_size, padding)
+    else:
+        comp_pad = 12 - padding
+        for x in range(0, img_size):
+            for y in range(0, img_size):
+                if comp_pad <= x < 21 + comp_pad and (comp_pad <= y < 21 + comp_pad or img_size - comp_pad > y > img_size - 22 - comp_pad):
                     continue
-            img_frame.putpixel((x + padding, y + padding), (0, 0, 0, 0))
-    pos = qrcode.util.pattern_position(qr.version)
-    img_qr2 = qr.make_image().convert("RGBA")
-
-    # the lower right locate box
-    if colourful and (rgba != (0, 0, 0, 0)):
-        color_replace(img_qr2, rgba)
-    for i in pos:
-        for j in pos:
-            if (i == 6 and j == pos[-1]) or (j == 6 and i == pos[-1]) \
-                    or (i == 6 and j == 6):
-                continue
-            else:
-                rect = (3 * (i - 2) + 12, 3 * (j - 2) + 12, 3 * (i + 3) + 12, 3 * (j + 3) + 12)
-                img_tmp = img_qr2.crop(rect)
-                img_frame.paste(img_tmp, rect)
+                if img_size - comp_pad > x > img_size - 22 - comp_pad and (comp_pad <= y < 21 + comp_pad):
+                    continue
+                if (x % 3 == 1 and y % 3 == 1):
+                    if (img_frame_l.getpixel((x + padding, y + padding)) > 70 and img_enh_l.getpixel((x, y)) < 185) \
+                            or (img_frame_l.getpixel((x + padding, y + padding)) < 185 and img_enh_l.getpixel((x, y)) > 70):
+                        continue
+                img_frame.putpixel((x + padding, y + padding), (0, 0, 0, 0))
+    for rect, patch in template.patches:
+        img_frame.paste(patch, rect)
 
-    img_res = Image.new("RGBA", (img_frame.size[0] * 10, img_frame.size[1] * 10), (255, 255, 255, 255))
-    img_res.paste(img_enh, (padding * 10, padding * 10), img_enh)
-    img_frame = img_frame.resize((img_frame.size[0] * 10, img_frame.size[1] * 10))
+    res_size = template.size * scale
+    img_res = Image.new("RGBA", (res_size, res_size), (255, 255, 255, 255))
+    img_res.paste(img_enh, (padding * scale, padding * scale), img_enh)
+    if scale != 1:
+        img_frame = img_frame.resize((res_size, res_size))
     img_res.paste(img_frame, (0, 0), img_frame)
     img_res = img_res.convert('RGB')
     if pixelate:
-        return img_res.resize(img_qr.size).resize((img_img_size, img_img_size))
+        if scale != 1:
+            img_res = img_res.resize((template.size, template.size))
+        return img_res.resize((img_img_size, img_img_size))
     return img_res
 
 
+def _positive_int(value):
+    """argparse type of the arguments that count from 1"""
+    import argparse
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('should be at least 1, got ' + value)
+    return number
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Combine your QR code with custom picture")
@@ -210,6 +464,9 @@ def main():
     parser.add_argument("-C", "--colourful", action="store_true",help="colourful mode")
     parser.add_argument("-r", "--rgba", nargs=4, metavar=('R','G','B','A'),type = int, help="color to replace black")
     parser.add_argument("-p", "--pixelate", action="store_true",help="pixelate")
+    parser.add_argument("-s", "--stride", type=_positive_int, default=1, help="keep one frame out of STRIDE")
+    parser.add_argument("--max-size", type=int, help="downscale the frames to this longest side")
+    parser.add_argument("--scale", type=int, help="output pixels per QR image pixel, 10 by default, 1 with --pixelate")
     args = parser.parse_args()
 
     img = args.image
@@ -239,7 +496,8 @@ def main():
             rgba = (0,0,0,255)
     else:
         rgba = (0,0,0,255)
-    frames = produce(txt,img,ver,ec,bri, cont ,colourful = colr,rgba=rgba,pixelate = pixelate)
+    frames = produce(txt,img,ver,ec,bri, cont ,colourful = colr,rgba=rgba,pixelate = pixelate,
+                     stride=args.stride, max_size=args.max_size, scale=args.scale)
     if len(frames) == 1 or output.upper()[-3:] != "GIF":
         frames[0].save(output)
     elif len(frames) > 1:
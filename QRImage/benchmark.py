@@ -0,0 +1,170 @@
+"""
+Micro benchmarks for CuteRMP.
+
+Run from this directory: `python benchmark.py`.
+The frames are taken from `../test_images/worship.gif`.
+"""
+from PIL import Image
+from PIL import ImageSequence
+import multiprocessing
+import resource
+import time
+import qrcode
+import CuteRMP
+
+
+TEST_GIF = '../test_images/worship.gif'
+TEXT = 'https://github.com/yo1995/QRcode_Playground'
+
+
+def load_frames(path=TEST_GIF):
+    with Image.open(path) as img:
+        return [frame.copy() for frame in ImageSequence.Iterator(img)]
+
+
+def bench_blend(path=TEST_GIF, ver=5, colourful=True, rgba=(100, 50, 100, 255)):
+    """
+    Produce every frame of the GIF with the pixel loop and with the NumPy masks,
+    report the latency per frame and check the frames are the same.
+    """
+    frames = load_frames(path)
+    print('Blend, {} frames of {}, version {}, ms per frame'.format(len(frames), path, ver))
+    results = {}
+    for vectorize in (False, True):
+        t = time.time()
+        results[vectorize] = [CuteRMP.produce_impl(TEXT, frame, ver, qrcode.constants.ERROR_CORRECT_H,
+                                                   colourful=colourful, rgba=rgba, vectorize=vectorize)
+                              for frame in frames]
+        t = time.time() - t
+        print('{:<8} {:>8.1f}'.format('numpy' if vectorize else 'loop', t * 1000 / len(frames)))
+    same = all(a.tobytes() == b.tobytes() for a, b in zip(results[False], results[True]))
+    print('identical frames:', same)
+    return
+
+
+def bench_template(path=TEST_GIF, versions=(5, 20), colourful=True, rgba=(100, 50, 100, 255)):
+    """
+    Produce every frame of the GIF with the QR template built for each frame, as produce_impl used to,
+    and with the template built once and shared, report the latency per frame.
+    """
+    frames = load_frames(path)
+    err_crt = qrcode.constants.ERROR_CORRECT_H
+    print('QR template, {} frames of {}, ms per frame'.format(len(frames), path))
+    for ver in versions:
+        results = []
+        for shared in (False, True):
+            template = CuteRMP.QRTemplate(TEXT, ver, err_crt, colourful, rgba) if shared else None
+            t = time.time()
+            for frame in frames:
+                if not shared:
+                    template = CuteRMP.QRTemplate(TEXT, ver, err_crt, colourful, rgba)
+                CuteRMP.produce_impl(TEXT, frame, ver, err_crt, colourful=colourful, rgba=rgba, template=template)
+            results.append((time.time() - t) * 1000 / len(frames))
+        print('version {:>2}  per frame {:>8.1f}  shared {:>8.1f}'.format(ver, *results))
+    return
+
+
+def bench_color_replace(ver=40, box_size=3, rgba=(100, 50, 100, 200), repeat=3):
+    """
+    Recolor a QR code image with the pixel loop and with NumPy, report the time per image
+    and check the images are the same. A rectangular crop is checked too.
+    """
+    qr = qrcode.QRCode(version=ver, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=box_size)
+    qr.add_data(TEXT)
+    qr.make(fit=False)
+    img = qr.make_image().convert('RGBA')
+    print('Color replace, version {} box size {}, {}x{} pixels, ms per image'.format(ver, box_size, *img.size))
+    results = {}
+    for vectorize in (False, True):
+        t = time.time()
+        for _ in range(repeat):
+            out = img.copy()
+            CuteRMP.color_replace(out, rgba, vectorize)
+        t = time.time() - t
+        results[vectorize] = out.tobytes()
+        print('{:<8} {:>8.1f}'.format('numpy' if vectorize else 'loop', t * 1000 / repeat))
+    rect = img.crop((0, 0, img.size[0], img.size[1] // 3))
+    a, b = rect.copy(), rect.copy()
+    CuteRMP.color_replace(a, rgba, False)
+    CuteRMP.color_replace(b, rgba, True)
+    print('identical images:', results[False] == results[True] and a.tobytes() == b.tobytes())
+    return
+
+
+def _produce_clip(path, repeat, stride, streamed, results):
+    """
+    Produce the clip of bench_stream in a process of its own, put (frames, first, total, peak RSS) in `results`.
+    """
+    def clip():
+        for _ in range(repeat):
+            yield from CuteRMP.iter_frames(path, stride)
+
+    t = time.time()
+    frames = clip() if streamed else list(clip())
+    produced = CuteRMP.iter_produce(TEXT, frames, colourful=True, rgba=(100, 50, 100, 255))
+    next(produced)
+    first = time.time() - t
+    n = 1 + sum(1 for _ in produced)
+    results.put((n, first, time.time() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def bench_stream(path=TEST_GIF, repeat=3, stride=1):
+    """
+    Produce the frames of a GIF or a video, `repeat` times over to make a longer clip, after loading
+    them all as decode_video_file does, and streamed through iter_produce. Report the time to the first
+    produced frame, the total time and the peak memory of the process reading the frames.
+    """
+    print('Streaming, {} x{}, seconds and peak RSS MB'.format(path, repeat))
+    for streamed in (False, True):
+        results = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_produce_clip, args=(path, repeat, stride, streamed, results))
+        proc.start()
+        n, first, total, peak = results.get()
+        proc.join()
+        print('{:<8} {} frames  first {:>6.2f}  total {:>6.2f}  peak {:>7.1f}'.format(
+            'stream' if streamed else 'load', n, first, total, peak))
+    return
+
+
+def _produce_scaled(path, scales, pixelate, results):
+    """
+    Produce the frames of bench_scale in a process of its own, one scale after the other from the
+    smallest, put (scale, output size, ms per frame, peak RSS MB over the frames loaded) in `results`.
+    """
+    frames = load_frames(path)
+    CuteRMP.get_template(TEXT, colourful=True, rgba=(100, 50, 100, 255))
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for scale in scales:
+        t = time.time()
+        for frame in frames:
+            out = CuteRMP.produce_impl(TEXT, frame, colourful=True, rgba=(100, 50, 100, 255),
+                                       pixelate=pixelate, scale=scale)
+        t = (time.time() - t) * 1000 / len(frames)
+        peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024
+        results.put((scale, out.size, t, peak))
+    results.put(None)
+
+
+def bench_scale(path=TEST_GIF, scales=(1, 3, 5, 10)):
+    """
+    Produce the frames of the GIF blended at several output scales, with and without pixelate.
+    Report the time per frame and the peak memory the frames take above the loaded input.
+    """
+    print('Output scale, {}, ms per frame and peak MB'.format(path))
+    for pixelate in (False, True):
+        results = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_produce_scaled, args=(path, sorted(scales), pixelate, results))
+        proc.start()
+        for scale, size, t, peak in iter(results.get, None):
+            print('{:<9} scale {:>2}  output {}x{}  {:>7.1f}  peak {:>6.1f}'.format(
+                'pixelate' if pixelate else 'blend', scale, size[0], size[1], t, peak))
+        proc.join()
+    return
+
+
+if __name__ == '__main__':
+    bench_scale()
+    bench_stream()
+    bench_color_replace()
+    bench_template()
+    bench_blend()